@@ -0,0 +1,203 @@
+# Asyncio variant of the salary consumer: Kafka polling and Postgres writes overlap (python async_consumer.py)
+
+import argparse
+import asyncio
+import signal
+from collections import Counter
+
+import asyncpg
+from confluent_kafka import Consumer, TopicPartition
+
+from consumer import SalaryConsumer, db_config, schema_ddl
+from employee import DepartmentAggregate, SalaryChange, decode_record
+from producer import employee_topic_name
+
+# Combiner batches not seen before; replays hit the primary key and return nothing
+insert_batches_sql = """
+    INSERT INTO department_salary_batch (batch_id, department, total_salary, emp_count)
+    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::bigint[], $4::int[])
+    ON CONFLICT DO NOTHING
+    RETURNING department, total_salary
+"""
+
+# Every department of a batch in one statement, in sorted order, so concurrent
+# transactions always lock the hot department rows in the same order and never deadlock
+upsert_totals_sql = """
+    INSERT INTO department_employee_salary (department, total_salary)
+    SELECT * FROM unnest($1::varchar[], $2::bigint[])
+    ON CONFLICT(department)
+    DO UPDATE SET total_salary = department_employee_salary.total_salary + EXCLUDED.total_salary
+"""
+
+
+class AsyncSalaryConsumer:
+    '''
+    Pipelined consumer: Consumer.consume runs in a worker thread and feeds one
+    asyncio queue per partition, while the event loop writes earlier batches through
+    an asyncpg pool. The pool size bounds the number of concurrent transactions.
+    Each partition has a single writer task, so its batches are applied and their
+    offsets committed in order; different partitions are written concurrently.
+    '''
+    def __init__(self, consumer, pool, batch_size=500, batch_timeout_ms=200, queued_batches=4):
+        self.consumer = consumer  # SalaryConsumer with auto_commit=False
+        self.pool = pool
+        self.batch_size = batch_size
+        self.batch_timeout_ms = batch_timeout_ms
+        self.queued_batches = queued_batches  # per partition; a full queue pauses polling
+        self.queues = {}  # (topic, partition) -> asyncio.Queue of message lists
+        self.writers = {}  # (topic, partition) -> writer task
+        self.done_offsets = {}  # (topic, partition) -> next offset, once written to Postgres
+        self.error = None
+        self.loop = None
+
+    def stop(self):
+        self.consumer.keep_runnning = False
+
+    async def run(self, topics):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.run_in_executor(None, lambda: self.consumer.subscribe(topics, on_revoke=self.on_revoke))
+        try:
+            while self.consumer.keep_runnning:
+                # Consumer.consume, not SalaryConsumer's per-message loop; the event loop keeps writing meanwhile
+                msgs = await self.loop.run_in_executor(None, lambda: Consumer.consume(
+                    self.consumer, num_messages=self.batch_size, timeout=self.batch_timeout_ms / 1000))
+                batches = {}
+                for msg in msgs:
+                    if self.consumer.is_record(msg):
+                        batches.setdefault((msg.topic(), msg.partition()), []).append(msg)
+                for key, batch in batches.items():
+                    await self.queue_for(key).put(batch)
+            await self.drain(list(self.queues))
+            self.commit_done(list(self.queues))
+        finally:
+            # Close first: it revokes the partitions, and on_revoke drains through the writers
+            await self.loop.run_in_executor(None, self.consumer.close)
+            for task in self.writers.values():
+                task.cancel()
+        if self.error is not None:
+            raise self.error
+
+    def queue_for(self, key):
+        if key not in self.queues:
+            self.queues[key] = asyncio.Queue(maxsize=self.queued_batches)
+            self.writers[key] = asyncio.create_task(self.write_partition(key, self.queues[key]))
+        return self.queues[key]
+
+    async def write_partition(self, key, queue):
+        while True:
+            batch = await queue.get()
+            try:
+                # After a failure nothing more is written or committed, so the failed batch is replayed
+                if self.error is None:
+                    await self.write_batch(batch)
+                    self.done_offsets[key] = batch[-1].offset() + 1
+                    self.consumer.commit(offsets=[TopicPartition(*key, self.done_offsets[key])], asynchronous=True)
+            except Exception as err:
+                print(f"Batch for {key[0]}[{key[1]}] failed, stopping: {err}")
+                self.error = err
+                self.stop()
+            finally:
+                queue.task_done()
+
+    async def write_batch(self, msgs, retries=1):
+        totals = Counter()
+        aggs = []
+        for msg in msgs:
+            try:
+                record = decode_record(msg.value(), msg.headers())
+            except Exception as err:
+                print(f"Skipping undecodable message at {msg.topic()}[{msg.partition()}]@{msg.offset()}: {err}")
+                continue
+            if isinstance(record, DepartmentAggregate):
+                aggs.append(record)
+            elif isinstance(record, SalaryChange):
+                # Deltas need the per-key contribution index, which only consumer.py maintains
+                raise ValueError(f"change event at {msg.topic()}[{msg.partition()}]@{msg.offset()}: use consumer.py")
+            else:
+                totals[record.emp_dept] += int(float(record.emp_salary))
+
+        for attempt in range(retries + 1):
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        applied = Counter(totals)
+                        if aggs:
+                            rows = await conn.fetch(insert_batches_sql,
+                                                    [a.batch_id for a in aggs], [a.emp_dept for a in aggs],
+                                                    [int(a.total_salary) for a in aggs], [int(a.emp_count) for a in aggs])
+                            for row in rows:
+                                applied[row['department']] += row['total_salary']
+                        if applied:
+                            depts = sorted(applied)
+                            await conn.execute(upsert_totals_sql, depts, [applied[d] for d in depts])
+                return
+            except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError):
+                # The pool replaces the broken connection; retry the whole transaction once
+                if attempt == retries:
+                    raise
+                print(f"Database connection lost, reconnecting (attempt {attempt + 1})")
+
+    async def drain(self, keys):
+        # Wait until every batch already queued for these partitions has been written;
+        # a partition whose writer has stopped has nobody left to finish its queue
+        for key in keys:
+            if key in self.queues and not self.writers[key].done():
+                await self.queues[key].join()
+
+    async def forget(self, keys):
+        # Drop the writers and state of revoked partitions, so later commits never include
+        # them and a reassignment starts with a fresh queue and writer
+        for key in keys:
+            writer = self.writers.pop(key, None)
+            if writer is not None:
+                writer.cancel()
+            self.queues.pop(key, None)
+            self.done_offsets.pop(key, None)
+
+    def commit_done(self, keys):
+        offsets = [TopicPartition(*key, self.done_offsets[key]) for key in keys if key in self.done_offsets]
+        if offsets:
+            self.consumer.commit(offsets=offsets, asynchronous=False)
+
+    def on_revoke(self, consumer, partitions):
+        # Runs in the polling thread during a rebalance: finish and commit the queued batches
+        # of the revoked partitions before another consumer takes them over, then forget them
+        keys = [(tp.topic, tp.partition) for tp in partitions]
+        asyncio.run_coroutine_threadsafe(self.drain(keys), self.loop).result()
+        self.commit_done(keys)
+        asyncio.run_coroutine_threadsafe(self.forget(keys), self.loop).result()
+
+
+async def setup_schema(pool):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            for ddl in schema_ddl:
+                await conn.execute(ddl)
+
+
+async def main(args):
+    pool = await asyncpg.create_pool(host=db_config['host'], port=int(db_config['port']),
+                                     user=db_config['user'], password=db_config['password'],
+                                     database=db_config['database'],
+                                     min_size=1, max_size=args.max_transactions)
+    try:
+        await setup_schema(pool)
+        consumer = AsyncSalaryConsumer(SalaryConsumer(group_id="employee_consumer_salary", auto_commit=False),
+                                       pool, args.batch_size, args.batch_timeout_ms, args.queued_batches)
+        # Ctrl-C / SIGTERM: stop polling, write what is queued, commit, then exit
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(sig, consumer.stop)
+        await consumer.run([employee_topic_name])
+    finally:
+        await pool.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Consume employee salaries with overlapping Kafka polls and DB writes')
+    parser.add_argument('--batch-size', type=int, default=500, help='maximum messages per poll')
+    parser.add_argument('--batch-timeout-ms', type=int, default=200, help='maximum time to wait while filling a poll')
+    parser.add_argument('--max-transactions', type=int, default=4,
+                        help='maximum concurrent Postgres transactions (asyncpg pool size)')
+    parser.add_argument('--queued-batches', type=int, default=4,
+                        help='batches buffered per partition before polling pauses')
+    asyncio.run(main(parser.parse_args()))
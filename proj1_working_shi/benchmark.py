@@ -0,0 +1,333 @@
+# Benchmarks for the proj1 salary pipeline.
+# Run from this folder, e.g.: python benchmark.py transform --scale 100
+# The mock subcommand needs no broker: python benchmark.py mock --count 1000000
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import psycopg2.extras
+from confluent_kafka import Producer
+from confluent_kafka.serialization import StringSerializer
+
+from consumer import db_config
+from parse_cache import ParseCache
+from producer import (DataHandler, PipelinedSender, csv_file, default_chunksize, departments, produce_records,
+                      producer_profiles, salaryProducer)
+
+kafka_demo_producer = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Kafka_Demo', 'src', 'producer.py')
+bench_topic = 'bf_employee_salary_bench'  # never the real topic: the consumer would count these salaries
+
+
+def best_of(func, repeat):
+    # Best wall time over several runs; the minimum is the least noisy estimate
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def bench_transform(csv_path=csv_file, scale=1, repeat=3):
+    '''
+    Compare the row loop DataHandler.transform against the vectorized
+    DataHandler.transform_columns on the same DataFrame.
+    scale replicates the CSV rows to simulate bigger extracts.
+    '''
+    reader = DataHandler()
+    df = reader.read_csv(csv_path)
+    if scale > 1:
+        df = pd.concat([df] * scale, ignore_index=True)
+
+    loop_time, rows = best_of(lambda: reader.transform(df), repeat)
+    vec_time, (depts, salaries) = best_of(lambda: reader.transform_columns(df), repeat)
+
+    # Both paths must select exactly the same records
+    assert rows == [[d, s] for d, s in zip(depts, salaries.tolist())], 'transform paths disagree'
+
+    print(f"rows in: {len(df)}, rows out: {len(rows)}")
+    print(f"iterrows loop: {loop_time:.4f}s ({len(df) / loop_time:,.0f} rows/s)")
+    print(f"vectorized:    {vec_time:.4f}s ({len(df) / vec_time:,.0f} rows/s)")
+    print(f"speedup:       {loop_time / vec_time:.1f}x")
+    return {'rows': len(df), 'loop_s': loop_time, 'vectorized_s': vec_time}
+
+
+def bench_stream(csv_path=csv_file, chunksize=default_chunksize):
+    '''
+    Time-to-first-chunk, total time and peak RSS of one read mode.
+    chunksize=0 measures the whole-file read_csv path. Peak RSS only grows within a
+    process, so run each mode in its own process to compare them.
+    '''
+    reader = DataHandler()
+    start = time.perf_counter()
+    first = None
+    rows = 0
+    if chunksize > 0:
+        for depts, _ in reader.stream(csv_path, chunksize):
+            if first is None:
+                first = time.perf_counter() - start
+            rows += len(depts)
+    else:
+        depts, _ = reader.transform_columns(reader.read_csv(csv_path))
+        first = time.perf_counter() - start
+        rows = len(depts)
+    total = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"mode: {'chunks of ' + str(chunksize) if chunksize > 0 else 'whole file'}, rows out: {rows}")
+    print(f"first records ready: {first:.4f}s, total: {total:.4f}s, peak RSS: {peak_mb:.1f} MB")
+    return {'first_s': first, 'total_s': total, 'peak_rss_mb': peak_mb}
+
+
+def bench_cache(csv_path=csv_file, repeat=3):
+    '''
+    Whole-file transform from CSV text vs from a warm ParseCache (memory-mapped .npy columns).
+    '''
+    cache_dir = tempfile.mkdtemp(prefix='salary-parse-cache-')
+    try:
+        reader = DataHandler(ParseCache(cache_dir))
+        cold_time, _ = best_of(lambda: DataHandler().transform_file(csv_path), repeat)
+        reader.transform_file(csv_path)  # populate the cache
+        warm_time, _ = best_of(lambda: reader.transform_file(csv_path), repeat)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"parse CSV:   {cold_time:.4f}s")
+    print(f"warm cache:  {warm_time:.4f}s")
+    print(f"speedup:     {cold_time / warm_time:.1f}x")
+    return {'parse_s': cold_time, 'cache_s': warm_time}
+
+
+def bench_profiles(csv_path=csv_file, profiles=None, scale=1, codec='json', host='localhost', port='29092',
+                   topic=bench_topic):
+    '''
+    Produce the same transformed CSV once per salaryProducer profile and compare
+    msgs/s, bytes/s and delivery latency. scale repeats the records to get longer runs.
+    '''
+    reader = DataHandler()
+    depts, salaries = reader.transform_columns(reader.read_csv(csv_path))
+    encoder = StringSerializer('utf-8')
+    results = {}
+    for profile in profiles or sorted(producer_profiles):
+        sender = PipelinedSender(salaryProducer(host, port, profile))
+        for _ in range(scale):
+            produce_records(sender, encoder, depts, salaries, codec, topic)
+        sender.flush()
+        results[profile] = sender.stats()
+
+    print(f"{'profile':<12} {'msgs/s':>12} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for profile, stats in results.items():
+        print(f"{profile:<12} {stats['msgs_per_s']:>12,.0f} {stats['bytes_per_s'] / 1e6:>8.2f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['failed']:>7}")
+    return results
+
+
+def bench_sink(count=10000, **db_overrides):
+    '''
+    Per-message cost of the salary upsert on one connection: literal SQL per message
+    (the old f-string path), client-side parameters (still a new SQL text to parse and
+    plan each time), a server-side prepared statement, and one execute_values statement
+    over pre-aggregated totals. Writes go to a temp table, not department_employee_salary.
+    '''
+    rng = np.random.default_rng(0)
+    depts = np.array(departments, dtype=object)[rng.integers(0, len(departments), count)].tolist()
+    salaries = rng.integers(30000, 200000, count).tolist()
+    rows = list(zip(depts, salaries))
+    upsert = '''
+        INSERT INTO bench_salary (department, total_salary) VALUES ({}, {})
+        ON CONFLICT(department) DO UPDATE SET total_salary = bench_salary.total_salary + EXCLUDED.total_salary
+    '''
+
+    conn = psycopg2.connect(**dict(db_config, **db_overrides))
+    conn.autocommit = True  # one transaction per statement, like the per-message sink
+    cur = conn.cursor()
+    cur.execute('CREATE TEMP TABLE bench_salary (department VARCHAR(50) PRIMARY KEY, total_salary BIGINT DEFAULT 0)')
+    cur.execute('PREPARE bench_upsert (varchar, bigint) AS ' + upsert.format('$1', '$2'))
+
+    def literal():
+        for dept, salary in rows:
+            cur.execute(upsert.format(f"'{dept}'", salary))
+
+    def parameterized():
+        sql = upsert.format('%s', '%s')
+        for row in rows:
+            cur.execute(sql, row)
+
+    def prepared():
+        for row in rows:
+            cur.execute('EXECUTE bench_upsert (%s, %s)', row)
+
+    def batched():
+        totals = {}
+        for dept, salary in rows:
+            totals[dept] = totals.get(dept, 0) + salary
+        psycopg2.extras.execute_values(cur, upsert.replace('({}, {})', '%s'), sorted(totals.items()))
+
+    results = {}
+    try:
+        for name, func in [('literal SQL', literal), ('parameterized', parameterized),
+                           ('prepared', prepared), ('execute_values', batched)]:
+            elapsed, _ = best_of(func, 1)
+            results[name] = elapsed / count * 1e6
+            print(f"{name:<15} {results[name]:>10.1f} us/message")
+    finally:
+        conn.close()
+    return results
+
+
+class MockCluster:
+    '''
+    librdkafka's built-in mock cluster (test.mock.num.brokers). The cluster lives inside
+    a throwaway client; other clients reach it through the returned bootstrap address
+    for as long as that client is alive.
+    '''
+    def __init__(self, num_brokers=3):
+        self.num_brokers = num_brokers
+        self.client = None
+
+    def __enter__(self):
+        self.client = Producer({'bootstrap.servers': '', 'test.mock.num.brokers': self.num_brokers, 'log_level': 0})
+        brokers = self.client.list_topics(timeout=10).brokers.values()
+        return ','.join(f"{b.host}:{b.port}" for b in sorted(brokers, key=lambda b: b.id))
+
+    def __exit__(self, *exc):
+        self.client = None
+
+
+def load_kafka_demo_producer():
+    # Kafka_Demo/src is not a package, so load its producer module by path
+    spec = importlib.util.spec_from_file_location('kafka_demo_producer', kafka_demo_producer)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_mock(target='salary', count=100000, record_bytes=0, codec='json', profile='default',
+               brokers=3, max_in_flight=100000, topic=bench_topic, output='mock_benchmark.json'):
+    '''
+    Producer throughput benchmark against the mock cluster, so it runs on any box.
+    target 'salary' drives salaryProducer (with record_bytes=0, through the real
+    produce_records path); target 'demo' drives Kafka_Demo's create_producer.
+    Results go to a JSON report.
+    '''
+    rng = np.random.default_rng(0)
+    encoder = StringSerializer('utf-8')
+    with MockCluster(brokers) as bootstrap:
+        if target == 'salary':
+            host, _, port = bootstrap.partition(',')[0].rpartition(':')
+            # The mock advertises every broker, so one bootstrap address is enough
+            producer = salaryProducer(host, port, profile)
+        else:
+            demo = load_kafka_demo_producer()
+            demo.KAFKA_BOOTSTRAP_SERVERS = bootstrap
+            producer = demo.create_producer()
+        sender = PipelinedSender(producer, max_in_flight)
+
+        if target == 'salary' and record_bytes == 0:
+            depts = np.array(departments, dtype=object)[rng.integers(0, len(departments), count)]
+            salaries = rng.integers(30000, 200000, count)
+            produce_records(sender, encoder, depts, salaries, codec, topic)
+        else:
+            # Opaque payloads of a fixed size, keyed round-robin over a few keys
+            payload = rng.bytes(record_bytes or 256)
+            keys = [encoder(f"key-{i}") for i in range(16)]
+            for i in range(count):
+                sender.send(topic, keys[i % len(keys)], payload)
+        remaining = sender.flush(60)
+        stats = sender.stats()
+        percentiles = [v * 1000 for v in sender.latencies.percentiles([50, 95, 99, 99.9])]
+        avg_bytes = sender.sent_bytes / stats['sent'] if stats['sent'] else 0.0
+        # Drop the producer before the mock cluster goes away, or it logs reconnect failures
+        del sender, producer
+
+    report = {'target': target,
+              'profile': profile if target == 'salary' else 'create_producer defaults',
+              'codec': codec if target == 'salary' and record_bytes == 0 else 'raw',
+              'record_bytes': round(avg_bytes, 1),
+              'count': count,
+              'brokers': brokers,
+              'delivered': stats['delivered'],
+              'failed': stats['failed'],
+              'undelivered': remaining,
+              'elapsed_s': round(stats['elapsed_s'], 4),
+              'msgs_per_s': round(stats['msgs_per_s'], 1),
+              'mb_per_s': round(stats['bytes_per_s'] / 1e6, 3),
+              'latency_ms': dict(zip(['p50', 'p95', 'p99', 'p999'], (round(float(v), 3) for v in percentiles))),
+              'python': platform.python_version(),
+              'host': platform.node()}
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='proj1 salary pipeline benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p_transform = sub.add_parser('transform', help='row loop vs vectorized transform')
+    p_transform.add_argument('--csv', default=csv_file)
+    p_transform.add_argument('--scale', type=int, default=1, help='replicate the CSV this many times')
+    p_transform.add_argument('--repeat', type=int, default=3)
+
+    p_stream = sub.add_parser('stream', help='time-to-first-chunk and peak RSS of one read mode')
+    p_stream.add_argument('--csv', default=csv_file)
+    p_stream.add_argument('--chunksize', type=int, default=default_chunksize, help='0 = whole-file read')
+
+    p_cache = sub.add_parser('cache', help='CSV parse vs warm parse cache')
+    p_cache.add_argument('--csv', default=csv_file)
+    p_cache.add_argument('--repeat', type=int, default=3)
+
+    p_profiles = sub.add_parser('profiles', help='compare salaryProducer tuning profiles against a broker')
+    p_profiles.add_argument('--csv', default=csv_file)
+    p_profiles.add_argument('--profile', dest='profiles', action='append', choices=sorted(producer_profiles),
+                            help='profile to include, can be repeated (default: all)')
+    p_profiles.add_argument('--scale', type=int, default=100, help='produce the records this many times')
+    p_profiles.add_argument('--codec', choices=['json', 'binary'], default='json')
+    p_profiles.add_argument('--host', default='localhost')
+    p_profiles.add_argument('--port', default='29092')
+    p_profiles.add_argument('--topic', default=bench_topic)
+
+    p_sink = sub.add_parser('sink', help='per-message upsert cost: literal SQL vs prepared vs execute_values')
+    p_sink.add_argument('--count', type=int, default=10000)
+    p_sink.add_argument('--host', default=db_config['host'])
+    p_sink.add_argument('--port', default=db_config['port'])
+
+    p_mock = sub.add_parser('mock', help='producer throughput against the librdkafka mock cluster, no broker needed')
+    p_mock.add_argument('--target', choices=['salary', 'demo'], default='salary',
+                        help='salary = proj1 salaryProducer, demo = Kafka_Demo create_producer')
+    p_mock.add_argument('--count', type=int, default=100000)
+    p_mock.add_argument('--record-bytes', type=int, default=0,
+                        help='synthetic payload size; 0 = real employee records (salary target only)')
+    p_mock.add_argument('--codec', choices=['json', 'binary'], default='json')
+    p_mock.add_argument('--profile', choices=sorted(producer_profiles), default='default')
+    p_mock.add_argument('--brokers', type=int, default=3)
+    p_mock.add_argument('--max-in-flight', type=int, default=100000)
+    p_mock.add_argument('--output', default='mock_benchmark.json', help='JSON report path ("" to skip)')
+
+    args = parser.parse_args()
+    if args.bench == 'transform':
+        bench_transform(args.csv, args.scale, args.repeat)
+    elif args.bench == 'stream':
+        bench_stream(args.csv, args.chunksize)
+    elif args.bench == 'cache':
+        bench_cache(args.csv, args.repeat)
+    elif args.bench == 'profiles':
+        bench_profiles(args.csv, args.profiles, args.scale, args.codec, args.host, args.port, args.topic)
+    elif args.bench == 'sink':
+        bench_sink(args.count, host=args.host, port=args.port)
+    elif args.bench == 'mock':
+        bench_mock(args.target, args.count, args.record_bytes, args.codec, args.profile, args.brokers,
+                   args.max_in_flight, output=args.output)
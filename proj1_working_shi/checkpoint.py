@@ -0,0 +1,82 @@
+# Checkpoint file for resumable, incremental CSV ingestion (producer.py --checkpoint)
+
+import hashlib
+import json
+import os
+import time
+
+head_bytes = 65536  # bytes hashed from the start of the file
+tail_bytes = 4096  # bytes hashed just before the checkpoint offset
+
+
+def hash_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha1(f.read(end - start)).hexdigest()
+
+
+class IngestCheckpoint:
+    '''
+    Remembers the byte offset in a CSV up to which every row has been delivered,
+    together with a fingerprint of the bytes before that offset (a hash of the
+    file head and of the bytes just before the offset).
+    If the fingerprint still matches, the file was only appended to and ingestion
+    resumes at the offset; otherwise the file was rewritten and starts from 0.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def fingerprint(self, csv_path, offset):
+        head_end = min(head_bytes, offset)
+        return {'head_sha1': hash_range(csv_path, 0, head_end),
+                'tail_sha1': hash_range(csv_path, max(offset - tail_bytes, 0), offset)}
+
+    def resume_offset(self, csv_path):
+        offset = self.state.get('offset', 0)
+        if offset == 0:
+            return 0
+        if offset > os.path.getsize(csv_path) or self.fingerprint(csv_path, offset) != self.state['fingerprint']:
+            print(f"Checkpoint {self.path} does not match {csv_path} (file was rewritten), starting from the beginning")
+            self.state = {}
+            return 0
+        return offset
+
+    def bind_block_bytes(self, csv_path, block_bytes):
+        # Combiner batch ids name a block by its byte range, and where a block ends depends on
+        # block_bytes. A rerun with another size would give an applied block new ids and count
+        # it twice, so the size is recorded before the first block and must match afterwards.
+        recorded = self.state.get('block_bytes')
+        if recorded is not None and recorded != block_bytes:
+            raise ValueError(f"checkpoint {self.path} was written with --block-bytes {recorded}, "
+                             f"rerun with the same value (got {block_bytes})")
+        if recorded is None:
+            self.state['block_bytes'] = block_bytes
+            self.write(csv_path)
+
+    def file_id(self, csv_path):
+        # Stable id of the file content, unaffected by appends; used for combiner batch ids
+        return hash_range(csv_path, 0, min(head_bytes, os.path.getsize(csv_path)))[:12]
+
+    def save(self, csv_path, offset, rows):
+        # Only called once every message up to offset has been acknowledged by the broker.
+        # Written to a temp file and renamed, so a crash never leaves a torn checkpoint
+        self.state = {'csv': os.path.abspath(csv_path),
+                      'offset': offset,
+                      'rows': self.state.get('rows', 0) + rows,
+                      'fingerprint': self.fingerprint(csv_path, offset),
+                      'block_bytes': self.state.get('block_bytes'),
+                      'updated': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self.write(csv_path)
+
+    def write(self, csv_path):
+        self.state.setdefault('csv', os.path.abspath(csv_path))
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
@@ -0,0 +1,108 @@
+# Streaming reads of gzip, bzip2 and zstd compressed salary extracts (producer.py)
+
+import bz2
+import gzip
+import io
+import queue
+import threading
+
+# Leading bytes of each supported format; anything else is read as a plain file
+compression_magic = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+}
+
+
+def detect_compression(path):
+    # Format from the file's magic bytes, not its name: 'gzip', 'bz2', 'zstd' or None
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for magic, codec in compression_magic.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def open_decompressed(path, codec):
+    # Binary file object of the decompressed bytes; zstd needs the optional zstandard package
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+    if codec == 'bz2':
+        return bz2.open(path, 'rb')
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(f"{path} is zstd compressed: pip install zstandard to read it") from None
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+
+
+class DecompressingReader(io.RawIOBase):
+    '''
+    Decompressed view of a compressed file. A background thread reads and decompresses
+    blocks into a bounded queue while the caller parses earlier ones, so decompression
+    overlaps with CSV parsing and producing (zlib, bz2 and zstandard release the GIL),
+    and the decompressed data is never written to disk. queued_blocks bounds memory.
+    '''
+    def __init__(self, path, codec, block_bytes=1024 * 1024, queued_blocks=8):
+        self.source = open_decompressed(path, codec)
+        self.block_bytes = block_bytes
+        self.blocks = queue.Queue(maxsize=queued_blocks)
+        self.stopping = threading.Event()
+        self.pending = memoryview(b'')
+        self.eof = False
+        self.thread = threading.Thread(target=self.decompress, name=f"decompress-{codec}", daemon=True)
+        self.thread.start()
+
+    def decompress(self):
+        # Background thread: blocks of decompressed bytes, then None at the end (or the error)
+        try:
+            with self.source:
+                while not self.stopping.is_set():
+                    block = self.source.read(self.block_bytes)
+                    if not block:
+                        break
+                    self.put(block)
+            self.put(None)
+        except Exception as err:
+            self.put(err)
+
+    def put(self, item):
+        # Wait for room, but give up once the reader is closed
+        while not self.stopping.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending and not self.eof:
+            item = self.blocks.get()
+            if item is None:
+                self.eof = True
+            elif isinstance(item, Exception):
+                self.eof = True
+                raise item
+            else:
+                self.pending = memoryview(item)
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        super().close()
+
+
+def open_input(path, block_bytes=1024 * 1024):
+    # Binary file object for a salary extract, decompressed in the background when compressed
+    codec = detect_compression(path)
+    if codec is None:
+        return open(path, 'rb')
+    return io.BufferedReader(DecompressingReader(path, codec, block_bytes))
@@ -23,101 +23,723 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import json
+import argparse
+import csv
+import io
+import os
 import random
 import string
 import sys
+import time
+import weakref
+from collections import Counter
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 from confluent_kafka import Consumer, KafkaError, KafkaException
 from confluent_kafka.serialization import StringDeserializer
-from employee import Employee
+from employee import DepartmentAggregate, Employee, SalaryChange, decode_record
+from metrics import ConsumerMetrics, serve_metrics
+from dedup import SeenEmployees
+from rollup import RollupCube, parse_rollup
+from sketches import DepartmentSketches
 from producer import employee_topic_name #you do not want to hard copy it
 
+# use localhost if not run in Docker
+db_config = {'host': '0.0.0.0',
+             'database': 'postgres',
+             'user': 'postgres',
+             'port': '5432',
+             'password': 'postgres'}
+
+# All DDL the sink needs, run once by SalaryDatabase.setup_schema at startup
+schema_ddl = [
+    # Use department as PRIMARY KEY to ensure uniqueness
+    """
+    CREATE TABLE IF NOT EXISTS department_employee_salary (
+        department VARCHAR(50) PRIMARY KEY,
+        total_salary BIGINT DEFAULT 0
+    )
+    """,
+    # Combiner batches already applied, see ConsumingMethods.add_department_aggregate
+    """
+    CREATE TABLE IF NOT EXISTS department_salary_batch (
+        batch_id VARCHAR(64),
+        department VARCHAR(50),
+        total_salary BIGINT,
+        emp_count INTEGER,
+        PRIMARY KEY (batch_id, department)
+    )
+    """,
+    # Catch-up mode: rows are COPYed here and merged into the totals in the same transaction.
+    # Unlogged, since its rows never outlive that transaction.
+    """
+    CREATE UNLOGGED TABLE IF NOT EXISTS salary_staging (
+        department VARCHAR(50),
+        salary BIGINT
+    )
+    """,
+    # Sharded counters (--counter-slots): each writer adds to its own slot row of a department,
+    # so parallel writers do not queue on one hot row; compact_salary_slots folds them back
+    """
+    CREATE TABLE IF NOT EXISTS department_salary_slot (
+        department VARCHAR(50),
+        slot SMALLINT,
+        total_salary BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (department, slot)
+    )
+    """,
+    # Read side: compacted totals plus whatever is still spread over the slots
+    """
+    CREATE OR REPLACE VIEW department_salary_total AS
+    SELECT department, SUM(total_salary)::BIGINT AS total_salary
+    FROM (SELECT department, total_salary FROM department_employee_salary
+          UNION ALL
+          SELECT department, total_salary FROM department_salary_slot) AS parts
+    GROUP BY department
+    """,
+    # Change events (producer.py --changes): what each employee key currently contributes,
+    # so an upsert or retraction only applies its delta to the totals
+    """
+    CREATE TABLE IF NOT EXISTS salary_pcn_contribution (
+        pcn VARCHAR(64) PRIMARY KEY,
+        department VARCHAR(50) NOT NULL,
+        salary BIGINT NOT NULL
+    )
+    """,
+    # Exactly-once mode: next offset to consume per partition, written in the same
+    # transaction as the totals it produced
+    """
+    CREATE TABLE IF NOT EXISTS salary_consumer_offsets (
+        group_id VARCHAR(255),
+        topic VARCHAR(255),
+        kafka_partition INTEGER,
+        next_offset BIGINT NOT NULL,
+        PRIMARY KEY (group_id, topic, kafka_partition)
+    )
+    """,
+]
+
+# Server-side prepared statements: parsed and planned once per connection, then run with
+# EXECUTE name (params). Values are always sent as parameters, never spliced into the SQL.
+prepared_statements = {
+    'salary_upsert': """
+        PREPARE salary_upsert (varchar, bigint) AS
+        INSERT INTO department_employee_salary (department, total_salary)
+        VALUES ($1, $2)
+        ON CONFLICT(department)
+        DO UPDATE SET total_salary = department_employee_salary.total_salary + EXCLUDED.total_salary
+    """,
+}
+
+class SalaryDatabase:
+    '''
+    Connection pool owned by the consumer for its whole lifetime, replacing a new
+    connection per message. Schema setup runs once here instead of on every write.
+    Connections idle for longer than health_check_interval are tested before reuse,
+    and a unit of work that hits a broken connection is retried on a fresh one.
+    '''
+    def __init__(self, minconn=1, maxconn=4, health_check_interval=30.0, **config):
+        self.config = dict(db_config, **config)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **self.config)
+        self.health_check_interval = health_check_interval
+        # Per-connection state, dropped automatically when the pool closes a connection
+        self.last_used = weakref.WeakKeyDictionary()  # conn -> monotonic time it was last returned
+        self.prepared = weakref.WeakKeyDictionary()  # conn -> names of statements prepared in its session
+        self.setup_schema()
+
+    def setup_schema(self):
+        def create(cur):
+            for ddl in schema_ddl:
+                cur.execute(ddl)
+        self.run(create)
+
+    def is_healthy(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def checkout(self):
+        conn = self.pool.getconn()
+        idle = time.monotonic() - self.last_used.get(conn, 0)
+        if conn.closed or (idle > self.health_check_interval and not self.is_healthy(conn)):
+            # Stale or dead (e.g. database restarted): drop it and let the pool open a new one
+            self.discard(conn)
+            conn = self.pool.getconn()
+        return conn
+
+    def checkin(self, conn, close=False):
+        self.last_used[conn] = time.monotonic()
+        self.pool.putconn(conn, close=close)
+
+    def discard(self, conn):
+        # Close a broken connection; its session's prepared statements go with it
+        self.prepared.pop(conn, None)
+        self.checkin(conn, close=True)
+
+    def run(self, work, retries=1):
+        # Run work(cur) in a single transaction on a pooled connection and return its result.
+        # On a connection failure the connection is discarded and the work retried once.
+        for attempt in range(retries + 1):
+            conn = self.checkout()
+            try:
+                with conn:  # commit on success, rollback on error
+                    with conn.cursor() as cur:
+                        result = work(cur)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.discard(conn)
+                if attempt == retries:
+                    raise
+                print(f"Database connection lost, reconnecting (attempt {attempt + 1})")
+                continue
+            except Exception:
+                self.checkin(conn)
+                raise
+            self.checkin(conn)
+            return result
+
+    def execute_prepared(self, cur, name, params):
+        # PREPARE on first use in this session (it survives rollbacks), then EXECUTE
+        prepared = self.prepared.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(prepared_statements[name])
+            prepared.add(name)
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+    def close(self):
+        self.pool.closeall()
+
+def compact_salary_slots(cur):
+    # Compaction job: move every slot row into department_employee_salary in one statement.
+    # Slot rows written after this transaction's snapshot stay put and are folded next time.
+    cur.execute("""
+        WITH moved AS (
+            DELETE FROM department_salary_slot RETURNING department, total_salary
+        )
+        INSERT INTO department_employee_salary (department, total_salary)
+        SELECT department, SUM(total_salary) FROM moved GROUP BY department
+        ORDER BY department
+        ON CONFLICT(department)
+        DO UPDATE SET total_salary = department_employee_salary.total_salary + EXCLUDED.total_salary
+    """)
+    return cur.rowcount
+
+class CatchUpPolicy:
+    '''
+    When SalaryConsumer.consume_batches should switch to catch-up mode: once the
+    group's lag reaches enter_lag, batches of batch_size go to batch_func (the COPY
+    path) until lag falls below exit_lag. The gap between the two avoids flapping.
+    '''
+    def __init__(self, batch_func, batch_size=50000, enter_lag=100000, exit_lag=10000, check_interval=10.0):
+        self.batch_func = batch_func
+        self.batch_size = batch_size
+        self.enter_lag = enter_lag
+        self.exit_lag = exit_lag
+        self.check_interval = check_interval
+        self.active = False
+
+    def update(self, lag):
+        if not self.active and lag >= self.enter_lag:
+            print(f"Lag {lag} >= {self.enter_lag}: switching to catch-up mode")
+            self.active = True
+        elif self.active and lag < self.exit_lag:
+            print(f"Lag {lag} < {self.exit_lag}: back to streaming mode")
+            self.active = False
+        return self.active
+
 class SalaryConsumer(Consumer):
     #if running outside Docker (i.e. producer is NOT in the docer-compose file): host = localhost and port = 29092
     #if running inside Docker (i.e. producer IS IN the docer-compose file), host = 'kafka' or whatever name used for the kafka container, port = 9092
-    def __init__(self, host: str = "localhost", port: str = "29092", group_id: str = ''):
+    def __init__(self, host: str = "localhost", port: str = "29092", group_id: str = '', auto_commit: bool = True,
+                 metrics=None, lag_interval: float = 10.0):
+        # Batch mode turns auto commit off and commits offsets itself after each DB commit
         self.conf = {'bootstrap.servers': f'{host}:{port}',
                      'group.id': group_id,
-                     'enable.auto.commit': True,
+                     'enable.auto.commit': auto_commit,
                      'auto.offset.reset': 'earliest'}
         super().__init__(self.conf)
         
         #self.consumer = Consumer(self.conf)
         self.keep_runnning = True
         self.group_id = group_id
+        # Optional ConsumerMetrics; per-partition lag is refreshed every lag_interval seconds
+        self.metrics = metrics
+        self.lag_interval = lag_interval
+        self.next_lag_check = 0
+
+    def is_record(self, msg):
+        # True for a real record; partition EOF is logged, any other error is raised
+        if msg.error():
+            if msg.error().code() == KafkaError._PARTITION_EOF:
+                # Reached end of partition - informational, not an error
+                sys.stderr.write('%% %s [%d] reached end at offset %d\n' %
+                                 (msg.topic(), msg.partition(), msg.offset()))
+                return False
+            if self.metrics is not None:
+                self.metrics.error('kafka')
+            raise KafkaException(msg.error())
+        return True
 
     def consume(self, topics, processing_func):
         # Main consumer loop - polls messages and processes them
         try:
             self.subscribe(topics)
             while self.keep_runnning:
+                if self.metrics is not None:
+                    self.check_lag(self.lag_interval)
                 # Poll with 1 second timeout to balance responsiveness and CPU usage
                 msg = self.poll(timeout=1.0)
 
                 if msg is None:
                     # No message available, continue polling
                     continue
-                elif msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        # Reached end of partition - informational, not an error
-                        sys.stderr.write('%% %s [%d] reached end at offset %d\n' %
-                                         (msg.topic(), msg.partition(), msg.offset()))
-                    elif msg.error():
-                        raise KafkaException(msg.error())
-                else:
+                elif self.is_record(msg):
                     # Valid message received - process it
-                    print(f'Processing message: {msg.value()}')
+                    if self.metrics is not None:
+                        self.metrics.observe_records([msg])
                     processing_func(msg)
         finally:
             # Close down consumer to commit final offsets.
             self.close()
 
+    def consume_batches(self, topics, batch_func, batch_size=500, batch_timeout_ms=200, stored_offsets=None,
+                        catchup=None):
+        # Batch loop: pull up to batch_size messages or wait at most batch_timeout_ms, hand them
+        # to batch_func as one list, then commit offsets - only after batch_func has committed
+        # to the database, so a crash replays the batch instead of losing it.
+        # Needs auto_commit=False. If batch_func raises, nothing is committed and the loop stops.
+        # stored_offsets(partitions) -> {(topic, partition): offset} makes every assignment start
+        # from offsets kept outside Kafka (exactly-once mode); Kafka commits are then only for lag.
+        # catchup (a CatchUpPolicy) swaps in bigger batches and its own batch_func while lag is high.
+        try:
+            if stored_offsets is None:
+                self.subscribe(topics)
+            else:
+                self.subscribe(topics, on_assign=lambda consumer, partitions:
+                               self.assign_from(partitions, stored_offsets(partitions)))
+            while self.keep_runnning:
+                func, size = batch_func, batch_size
+                if catchup is not None:
+                    lag = self.check_lag(catchup.check_interval)
+                    if lag is not None:
+                        catchup.update(lag)
+                    if catchup.active:
+                        func, size = catchup.batch_func, catchup.batch_size
+                elif self.metrics is not None:
+                    self.check_lag(self.lag_interval)
+                # Consumer.consume, not the per-message loop above
+                msgs = super().consume(num_messages=size, timeout=batch_timeout_ms / 1000)
+                polled = time.monotonic()
+                batch = [msg for msg in msgs if self.is_record(msg)]
+                if batch:
+                    if self.metrics is not None:
+                        self.metrics.observe_records(batch)
+                        self.metrics.observe_batch(len(batch))
+                    try:
+                        func(batch)
+                    except Exception:
+                        if self.metrics is not None:
+                            self.metrics.error('batch')
+                        raise
+                    self.commit(asynchronous=False)
+                    if self.metrics is not None:
+                        self.metrics.observe_commit(time.monotonic() - polled)
+        finally:
+            self.close()
+
+    def lag(self):
+        # Messages between the committed offsets and the high watermarks of the current assignment
+        return sum(self.partition_lag().values())
+
+    def partition_lag(self):
+        lags = {}
+        for tp in self.committed(self.assignment(), timeout=10):
+            # Watermarks cached from fetch responses cost nothing; ask the broker only before the first fetch
+            low, high = self.get_watermark_offsets(tp, cached=True) or (-1, -1)
+            if high < 0:
+                low, high = self.get_watermark_offsets(tp, timeout=10)
+            committed = tp.offset if tp.offset >= 0 else low
+            lags[(tp.topic, tp.partition)] = max(high - committed, 0)
+        return lags
+
+    def check_lag(self, interval):
+        # Total lag, at most once per interval seconds (committed() is a broker round trip); None when not due
+        if time.monotonic() < self.next_lag_check or not self.assignment():
+            return None
+        self.next_lag_check = time.monotonic() + interval
+        lags = self.partition_lag()
+        if self.metrics is not None:
+            self.metrics.set_lag(lags)
+        return sum(lags.values())
+
+    def assign_from(self, partitions, offsets):
+        # Rebalance callback: start each newly assigned partition at its stored offset, if any
+        for tp in partitions:
+            if (tp.topic, tp.partition) in offsets:
+                tp.offset = offsets[(tp.topic, tp.partition)]
+        self.assign(partitions)
+        print(f"Assigned {[(tp.topic, tp.partition, tp.offset) for tp in partitions]}")
+
 #or can put all functions in a separte file and import as a module
 class ConsumingMethods:
-    @staticmethod
-    def add_salary(msg):
-        # Deserialize JSON message to Employee object
-        e = Employee(**(json.loads(msg.value())))
+    def __init__(self, db, offsets_group=None, metrics=None, cube=None, sketches=None, slot=None, dedup=None):
+        self.db = db  # SalaryDatabase shared by every message
+        # Exactly-once mode: offsets for this group id are kept in salary_consumer_offsets
+        self.offsets_group = offsets_group
+        self.metrics = metrics  # optional ConsumerMetrics: DB write latency and error counts
+        self.cube = cube  # optional RollupCube, written in the same transaction as each batch
+        self.sketches = sketches  # optional DepartmentSketches, updated after each committed batch
+        # Sharded counters: batch writes add to this slot of department_salary_slot instead
+        self.slot = slot
+        # Optional SeenEmployees: employees whose key was already counted (overlapping extracts,
+        # redelivered batches) are dropped; keys are claimed in the batch's own transaction
+        self.dedup = dedup
+
+    def add_salary(self, msg):
+        # Deserialize JSON or binary message (codec header) into an Employee, DepartmentAggregate or SalaryChange
+        record = decode_record(msg.value(), msg.headers())
+        start = time.monotonic()
         try:
-            # Connect to PostgreSQL database
-            conn = psycopg2.connect(
-                #use localhost if not run in Docker
-                host="0.0.0.0",
-                database="postgres",
-                user="postgres",
-                port = '5432',
-                password="postgres")
-            conn.autocommit = True  # Auto-commit for simplicity
-            cur = conn.cursor()
-            
-            # Create table if not exists - idempotent operation
-            # Use department as PRIMARY KEY to ensure uniqueness
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS department_employee_salary (
-                    department VARCHAR(50) PRIMARY KEY,
-                    total_salary BIGINT DEFAULT 0
-                )
-            """)
-            
-            # Upsert pattern: Insert new dept or add salary to existing dept
-            # ON CONFLICT handles concurrent writes and aggregates salary per department
-            # This approach maintains running totals without needing to pre-aggregate
-            cur.execute(f"""
-                INSERT INTO department_employee_salary (department, total_salary) 
-                VALUES ('{e.emp_dept}', {int(float(e.emp_salary))}) 
-                ON CONFLICT(department) 
-                DO UPDATE SET total_salary = department_employee_salary.total_salary + {int(float(e.emp_salary))}
-            """)
-            
-            print(f"Added {e.emp_salary} to department {e.emp_dept}")
-            cur.close()
+            if isinstance(record, DepartmentAggregate):
+                self.db.run(lambda cur: self.add_department_aggregate(cur, record))
+            elif isinstance(record, SalaryChange):
+                self.db.run(lambda cur: self.apply_changes(cur, [record]))
+            else:
+                self.db.run(lambda cur: self.add_employee_salary(cur, record))
         except Exception as err:
             # Log errors but continue processing - ensures one bad message doesn't stop consumer
             print(f"Error processing message: {err}")
+            if self.metrics is not None:
+                self.metrics.error('db')
+            return
+        if self.metrics is not None:
+            self.metrics.observe_db_write(time.monotonic() - start)
+
+    def add_salary_batch(self, msgs):
+        # Sum the batch per department in memory and write it as one multi-row upsert
+        self.write_batch(msgs, self.upsert_employees)
+
+    def add_salary_copy(self, msgs):
+        # Catch-up mode: stream the batch through COPY and merge it with one set-based statement
+        self.write_batch(msgs, self.copy_employees)
+
+    def write_batch(self, msgs, write_employees):
+        # One transaction per batch: employee rows via write_employees(cur, employees), then any
+        # combiner aggregates and change events, then (exactly-once mode) the partition offsets
+        decoded = []
+        for msg in msgs:
+            try:
+                decoded.append((msg, decode_record(msg.value(), msg.headers())))
+            except Exception as err:
+                # A record that cannot be decoded will never succeed; skip it, keep the batch
+                print(f"Skipping undecodable message at {msg.topic()}[{msg.partition()}]@{msg.offset()}: {err}")
+                if self.metrics is not None:
+                    self.metrics.error('decode')
+
+        def write(cur):
+            batch = decoded
+            if self.offsets_group is not None:
+                batch = self.skip_applied(cur, decoded)
+            employees = [record for _, record in batch if isinstance(record, Employee)]
+            duplicates = 0
+            if self.dedup is not None:
+                employees, duplicates = self.drop_duplicates(cur, employees)
+            aggs = [record for _, record in batch if isinstance(record, DepartmentAggregate)]
+            changes = [record for _, record in batch if isinstance(record, SalaryChange)]
+            summary = write_employees(cur, employees)
+            if self.cube is not None:
+                summary += f", {self.cube.write(cur, employees)} rollup groups"
+            applied = sum(self.add_department_aggregate(cur, agg) for agg in aggs)
+            if changes:
+                summary += f", {len(changes)} changes: {self.apply_changes(cur, changes)}"
+            if self.offsets_group is not None:
+                # Undecodable messages count as consumed too, so they are not replayed
+                self.store_offsets(cur, msgs)
+            if aggs:
+                summary += f" and {applied} aggregates ({len(aggs) - applied} replayed batches skipped)"
+            if duplicates:
+                summary += f", {duplicates} duplicate employees skipped"
+            return summary, employees
+        start = time.monotonic()
+        summary, employees = self.db.run(write)
+        if self.metrics is None:
+            print(f"Batch of {len(msgs)} messages: {summary}")
+        else:
+            self.metrics.observe_db_write(time.monotonic() - start)
+        if self.sketches is not None:
+            # Only committed batches reach the sketches, so a retried transaction is not counted twice
+            self.sketches.add(employees)
+            if self.sketches.due():
+                self.persist_sketches()
+
+    def persist_sketches(self):
+        # Runs after the batch has committed, so a failure here must not fail the batch: the
+        # caller would skip the Kafka commit and the replayed batch would be counted twice.
+        # The sketches stay dirty and are written again after the next batch.
+        try:
+            self.db.run(self.sketches.persist)
+        except Exception as err:
+            print(f"Error persisting sketches: {err}")
+            if self.metrics is not None:
+                self.metrics.error('sketches')
+            return
+        self.sketches.persisted()
+
+    def drop_duplicates(self, cur, employees):
+        # Employees without a key (no --dimensions) cannot be checked and always count. A rolled
+        # back transaction releases its claims, so a retry sees its own keys as new again.
+        new = self.dedup.claim(cur, [e.emp_pcn for e in employees if e.emp_pcn is not None])
+        kept = []
+        for e in employees:
+            if e.emp_pcn is None:
+                kept.append(e)
+            elif e.emp_pcn in new:
+                new.discard(e.emp_pcn)  # the first copy within the batch counts
+                kept.append(e)
+        return kept, len(employees) - len(kept)
+
+    def upsert_employees(self, cur, employees):
+        totals = Counter()
+        for e in employees:
+            totals[e.emp_dept] += int(float(e.emp_salary))
+        self.add_department_totals(cur, totals)
+        return f"added {dict(totals)}"
+
+    def copy_employees(self, cur, employees):
+        buf = io.StringIO()
+        csv.writer(buf).writerows((e.emp_dept, int(float(e.emp_salary))) for e in employees)
+        buf.seek(0)
+        cur.copy_expert("COPY salary_staging (department, salary) FROM STDIN WITH (FORMAT csv)", buf)
+        # Move the staged rows out and into the totals in one statement. Other consumers'
+        # uncommitted staging rows are invisible here, so concurrent catch-up batches don't mix.
+        cur.execute("""
+            WITH staged AS (
+                DELETE FROM salary_staging RETURNING department, salary
+            )
+        """ + self.totals_upsert("SELECT department, {slot}SUM(salary) FROM staged GROUP BY department"), self.slot_params())
+        return f"copied {len(employees)} rows into {cur.rowcount} departments"
+
+    def apply_changes(self, cur, changes):
+        # Turn change events into per-department deltas against each key's last contribution.
+        # Only the batch's keys are read (locked, so concurrent writers of a key queue up),
+        # which keeps a correction O(1) instead of a recompute. Replays are harmless:
+        # re-applying an upsert has delta 0 and retracting an absent key does nothing.
+        # Keys from --changes embed the department, so an upsert only changes a salary;
+        # the stored department is what a retraction subtracts from.
+        keys = sorted({change.emp_pcn for change in changes})
+        cur.execute("""
+            SELECT pcn, department, salary FROM salary_pcn_contribution WHERE pcn = ANY(%s) FOR UPDATE
+        """, (keys,))
+        index = {pcn: (dept, salary) for pcn, dept, salary in cur.fetchall()}
+        deltas = Counter()
+        for change in changes:  # in offset order, so the last event per key wins
+            old = index.get(change.emp_pcn)
+            if old is not None:
+                deltas[old[0]] -= old[1]
+            if change.op == 'upsert':
+                index[change.emp_pcn] = (change.emp_dept, int(float(change.emp_salary)))
+                deltas[change.emp_dept] += index[change.emp_pcn][1]
+            else:
+                index[change.emp_pcn] = None
+        current = [(pcn, *index[pcn]) for pcn in keys if index[pcn] is not None]
+        if current:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO salary_pcn_contribution (pcn, department, salary) VALUES %s
+                ON CONFLICT (pcn) DO UPDATE SET department = EXCLUDED.department, salary = EXCLUDED.salary
+            """, current)
+        retracted = [pcn for pcn in keys if index[pcn] is None]
+        if retracted:
+            cur.execute("DELETE FROM salary_pcn_contribution WHERE pcn = ANY(%s)", (retracted,))
+        deltas = Counter({dept: delta for dept, delta in deltas.items() if delta})
+        self.add_department_totals(cur, deltas)
+        return f"adjusted {dict(deltas)}"
+
+    def skip_applied(self, cur, decoded):
+        # Lock this group's offset rows for the batch's partitions and drop messages below the
+        # stored offset: another consumer (e.g. before a rebalance) already applied them
+        keys = sorted({(msg.topic(), msg.partition()) for msg, _ in decoded})
+        if not keys:
+            return decoded
+        cur.execute("""
+            SELECT topic, kafka_partition, next_offset FROM salary_consumer_offsets
+            WHERE group_id = %s AND (topic, kafka_partition) IN %s
+            FOR UPDATE
+        """, (self.offsets_group, tuple(keys)))
+        stored = {(topic, partition): offset for topic, partition, offset in cur.fetchall()}
+        return [(msg, record) for msg, record in decoded
+                if msg.offset() >= stored.get((msg.topic(), msg.partition()), -1)]
+
+    def store_offsets(self, cur, msgs):
+        # Next offset to read per partition, committed atomically with the totals
+        next_offsets = {}
+        for msg in msgs:
+            key = (msg.topic(), msg.partition())
+            next_offsets[key] = max(next_offsets.get(key, 0), msg.offset() + 1)
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO salary_consumer_offsets (group_id, topic, kafka_partition, next_offset)
+            VALUES %s
+            ON CONFLICT (group_id, topic, kafka_partition)
+            DO UPDATE SET next_offset = GREATEST(salary_consumer_offsets.next_offset, EXCLUDED.next_offset)
+        """, [(self.offsets_group, topic, partition, offset) for (topic, partition), offset in sorted(next_offsets.items())])
+
+    def load_offsets(self, partitions):
+        # on_assign helper for SalaryConsumer.consume_batches: stored offsets of the assigned partitions
+        def read(cur):
+            cur.execute("""
+                SELECT topic, kafka_partition, next_offset FROM salary_consumer_offsets WHERE group_id = %s
+            """, (self.offsets_group,))
+            return {(topic, partition): offset for topic, partition, offset in cur.fetchall()}
+        assigned = {(tp.topic, tp.partition) for tp in partitions}
+        return {key: offset for key, offset in self.db.run(read).items() if key in assigned}
+
+    def totals_upsert(self, source):
+        # INSERT ... ON CONFLICT DO UPDATE adding the (department, total) rows of source to the
+        # running totals, or in slot mode to this writer's slot rows. source selects the slot
+        # where it has a {slot} placeholder, filled from slot_params().
+        if self.slot is None:
+            return f"""
+                INSERT INTO department_employee_salary (department, total_salary)
+                {source.format(slot='')}
+                ON CONFLICT(department)
+                DO UPDATE SET total_salary = department_employee_salary.total_salary + EXCLUDED.total_salary
+            """
+        return f"""
+            INSERT INTO department_salary_slot (department, slot, total_salary)
+            {source.format(slot='%(slot)s, ')}
+            ON CONFLICT(department, slot)
+            DO UPDATE SET total_salary = department_salary_slot.total_salary + EXCLUDED.total_salary
+        """
+
+    def slot_params(self, **params):
+        return dict(params, slot=self.slot) if self.slot is not None else params
+
+    def add_department_totals(self, cur, totals):
+        # One INSERT ... ON CONFLICT DO UPDATE for every department in the batch. Departments
+        # are unique after pre-aggregation, which ON CONFLICT requires within one statement.
+        if not totals:
+            return
+        if self.slot is None:
+            rows = sorted(totals.items())
+        else:
+            rows = [(dept, self.slot, total) for dept, total in sorted(totals.items())]
+        psycopg2.extras.execute_values(cur, self.totals_upsert('VALUES %s'), rows)
+
+    def add_employee_salary(self, cur, e):
+        # Upsert pattern: Insert new dept or add salary to existing dept
+        # ON CONFLICT handles concurrent writes and aggregates salary per department
+        # This approach maintains running totals without needing to pre-aggregate
+        self.db.execute_prepared(cur, 'salary_upsert', (e.emp_dept, int(float(e.emp_salary))))
+
+    def add_department_aggregate(self, cur, agg):
+        # Applied batches are recorded in department_salary_batch; a replayed batch hits
+        # the primary key, inserts nothing, and so adds nothing to the running total.
+        # Returns 1 if the batch was applied, 0 if it was a replay.
+        cur.execute("""
+            WITH new_batch AS (
+                INSERT INTO department_salary_batch (batch_id, department, total_salary, emp_count)
+                VALUES (%(batch_id)s, %(department)s, %(total)s, %(count)s)
+                ON CONFLICT DO NOTHING
+                RETURNING department, total_salary
+            )
+        """ + self.totals_upsert("SELECT department, {slot}total_salary FROM new_batch"),
+                    self.slot_params(batch_id=agg.batch_id, department=agg.emp_dept,
+                                     total=int(agg.total_salary), count=int(agg.emp_count)))
+        return cur.rowcount
 
 if __name__ == '__main__':
+    group_id = "employee_consumer_salary"
+    parser = argparse.ArgumentParser(description='Consume employee salaries into department_employee_salary')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='micro-batch mode: up to this many messages per DB transaction (0 = one message at a time)')
+    parser.add_argument('--batch-timeout-ms', type=int, default=200,
+                        help='with --batch-size, maximum time to wait while filling a batch')
+    parser.add_argument('--exactly-once', action='store_true',
+                        help='store offsets in Postgres in the same transaction as the totals (implies batch mode)')
+    parser.add_argument('--catchup-lag', type=int, default=0,
+                        help='switch to COPY-based catch-up mode when lag reaches this many messages (0 = never; implies batch mode)')
+    parser.add_argument('--catchup-exit-lag', type=int, default=10000,
+                        help='leave catch-up mode once lag is below this')
+    parser.add_argument('--catchup-batch-size', type=int, default=50000)
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve Prometheus metrics at http://<metrics-host>:<port>/metrics (0 = off)')
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--rollup', action='append', metavar='DIM,DIM',
+                        help='maintain sum/count/min/max of salary per group of these dimensions (from producer.py '
+                             '--dimensions), can be repeated; implies batch mode. '
+                             'Dimensions: department, division, title, flsa, hire_year, hire_month')
+    parser.add_argument('--sketches', action='store_true',
+                        help='keep per-department salary quantile and distinct title/PCN sketches in salary_sketches '
+                             '(implies batch mode; report with sketches.py)')
+    parser.add_argument('--sketch-interval', type=float, default=60.0, help='seconds between sketch writes')
+    parser.add_argument('--sketch-instance', help='row id for this process in salary_sketches (default: host-pid-time)')
+    parser.add_argument('--counter-slots', type=int, default=0,
+                        help='sharded counters: add totals to one of this many slot rows per department '
+                             '(read department_salary_total; implies batch mode)')
+    parser.add_argument('--worker-id', type=int,
+                        help='with --counter-slots, picks the slot (worker id modulo slots; default: process id)')
+    parser.add_argument('--compact-slots', action='store_true',
+                        help='fold all slot rows into department_employee_salary and exit')
+    parser.add_argument('--dedup', action='store_true',
+                        help='count each employee key (producer.py --dimensions) once, skipping duplicates from '
+                             'overlapping extracts and redelivered batches; keys are kept in salary_seen_employee '
+                             '(implies batch mode)')
+    args = parser.parse_args()
+    try:
+        rollups = [parse_rollup(spec) for spec in args.rollup or []]
+    except ValueError as err:
+        parser.error(str(err))
+    if (args.exactly_once or args.catchup_lag > 0 or rollups or args.sketches or args.counter_slots > 0
+            or args.dedup) \
+            and args.batch_size <= 0:
+        args.batch_size = 500
+    slot = None
+    if args.counter_slots > 0:
+        slot = (os.getpid() if args.worker_id is None else args.worker_id) % args.counter_slots
+
+    # One connection pool for the whole run; schema is created here, not per message
+    db = SalaryDatabase()
+    if args.compact_slots:
+        print(f"Compacted slot rows into {db.run(compact_salary_slots)} departments")
+        db.close()
+        sys.exit(0)
+    metrics = None
+    if args.metrics_port:
+        metrics = ConsumerMetrics()
+        serve_metrics(metrics, args.metrics_port, args.metrics_host)
+    cube = None
+    if rollups:
+        cube = RollupCube(rollups)
+        db.run(cube.setup)
+    sketches = None
+    if args.sketches:
+        sketches = DepartmentSketches(args.sketch_instance, args.sketch_interval)
+        db.run(sketches.setup)
+    dedup = None
+    if args.dedup:
+        dedup = SeenEmployees()
+        db.run(dedup.setup)
+    methods = ConsumingMethods(db, offsets_group=group_id if args.exactly_once else None, metrics=metrics, cube=cube,
+                               sketches=sketches, slot=slot, dedup=dedup)
+    batch_mode = args.batch_size > 0
     # Use specific group_id to enable consumer group management and offset tracking
-    consumer = SalaryConsumer(group_id="employee_consumer_salary")
-    # Start consuming from the specified topic and process with add_salary function
-    consumer.consume([employee_topic_name], ConsumingMethods.add_salary)
\ No newline at end of file
+    consumer = SalaryConsumer(group_id=group_id, auto_commit=not batch_mode, metrics=metrics)
+    try:
+        if batch_mode:
+            consumer.consume_batches([employee_topic_name], methods.add_salary_batch,
+                                     args.batch_size, args.batch_timeout_ms,
+                                     methods.load_offsets if args.exactly_once else None,
+                                     CatchUpPolicy(methods.add_salary_copy, args.catchup_batch_size,
+                                                   args.catchup_lag, args.catchup_exit_lag)
+                                     if args.catchup_lag > 0 else None)
+        else:
+            # Start consuming from the specified topic and process with add_salary function
+            consumer.consume([employee_topic_name], methods.add_salary)
+    finally:
+        if sketches is not None:
+            db.run(sketches.persist)
+            sketches.persisted()
+        db.close()
@@ -0,0 +1,204 @@
+# Deduplication by employee key: a Bloom filter backed by an exact key set (producer.py --dedup PATH)
+# and the consumer's transactional seen-set (consumer.py --dedup)
+
+import hashlib
+import math
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+
+class BloomFilter:
+    '''
+    Fixed-size Bloom filter: k bit positions per key from one 128-bit hash (double
+    hashing), sized for capacity keys at error_rate false positives.
+    '''
+    def __init__(self, capacity, error_rate):
+        self.capacity = int(capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+    def add(self, key):
+        for p in self.positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    '''
+    Chain of Bloom filters: when the newest is full, a new one with growth times the
+    capacity and a tighter error rate is added, so memory tracks the number of keys
+    actually seen and the overall false positive rate stays below error_rate.
+    '''
+    def __init__(self, initial_capacity=1000000, error_rate=0.001, growth=2, tightening=0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+    def __contains__(self, key):
+        return any(key in f for f in self.filters)
+
+    def add(self, key):
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            n = len(self.filters)
+            self.filters.append(BloomFilter(self.initial_capacity * self.growth ** n,
+                                            self.error_rate * (1 - self.tightening) * self.tightening ** n))
+        self.filters[-1].add(key)
+
+    def nbytes(self):
+        return sum(f.bits.nbytes for f in self.filters)
+
+    def save(self, path, key_count=0):
+        # key_count: size of the key set the filter was built from, checked by DedupFilter on load
+        arrays = {'meta': np.array([self.initial_capacity, self.error_rate, self.growth, self.tightening]),
+                  'key_count': np.array([key_count], dtype=np.int64)}
+        for i, f in enumerate(self.filters):
+            arrays[f'bits{i}'] = f.bits
+            arrays[f'filter{i}'] = np.array([f.capacity, f.error_rate, f.count])
+        with open(path, 'wb') as out:
+            np.savez(out, **arrays)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            initial_capacity, error_rate, growth, tightening = data['meta'].tolist()
+            sbf = ScalableBloomFilter(int(initial_capacity), error_rate, int(growth), tightening)
+            sbf.key_count = int(data['key_count'][0]) if 'key_count' in data else -1
+            i = 0
+            while f'bits{i}' in data:
+                capacity, rate, count = data[f'filter{i}'].tolist()
+                f = BloomFilter(capacity, rate)
+                f.bits = data[f'bits{i}'].copy()
+                f.count = int(count)
+                sbf.filters.append(f)
+                i += 1
+        return sbf
+
+
+class DedupFilter:
+    '''
+    Seen-set of employee keys. The scalable Bloom filter answers "definitely new" from
+    memory; only its possible positives are confirmed against the exact key set, an
+    SQLite file next to the snapshot, so false positives never drop a row and memory
+    stays bounded at millions of keys. The SQLite set is the source of truth and the
+    filter at path a derived copy: it is only used when it was built from exactly the
+    committed keys, otherwise it is rebuilt from SQLite on load.
+    '''
+    def __init__(self, path, initial_capacity=1000000, error_rate=0.001, snapshot_interval=60.0):
+        self.path = path
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.snapshot_interval = snapshot_interval
+        self.exact = sqlite3.connect(f"{path}.keys.sqlite")
+        self.exact.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.bloom = self.load_bloom()
+        self.last_snapshot = time.monotonic()
+        self.false_positives = 0
+
+    def key_count(self):
+        return self.exact.execute("SELECT count(*) FROM seen").fetchone()[0]
+
+    def load_bloom(self):
+        # Keys are only ever added, so a filter built from as many keys as SQLite holds was built from the same keys
+        keys = self.key_count()
+        if os.path.exists(self.path):
+            bloom = ScalableBloomFilter.load(self.path)
+            if bloom.key_count == keys:
+                return bloom
+        bloom = ScalableBloomFilter(max(self.initial_capacity, keys), self.error_rate)
+        for (key,) in self.exact.execute("SELECT key FROM seen"):
+            bloom.add(key)
+        return bloom
+
+    def seen(self, key):
+        if key not in self.bloom:
+            return False
+        if self.exact.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone():
+            return True
+        self.false_positives += 1
+        return False
+
+    def new_mask(self, keys):
+        # True for keys neither seen before nor repeated earlier in keys; does not record them
+        mask, batch = [], set()
+        for key in keys:
+            mask.append(key is not None and key not in batch and not self.seen(key))
+            batch.add(key)
+        return np.array(mask, dtype=bool)
+
+    def add(self, keys):
+        for key in keys:
+            self.bloom.add(key)
+        self.exact.executemany("INSERT OR IGNORE INTO seen (key) VALUES (?)", ((key,) for key in keys))
+
+    def due(self):
+        return time.monotonic() - self.last_snapshot >= self.snapshot_interval
+
+    def snapshot(self):
+        # Commit the exact set, then write the filter tagged with its key count via a temp file
+        # and rename; a crash in between leaves a filter whose count no longer matches
+        self.exact.commit()
+        tmp = f"{self.path}.tmp"
+        self.bloom.save(tmp, self.key_count())
+        os.replace(tmp, self.path)
+        self.last_snapshot = time.monotonic()
+
+    def close(self):
+        self.exact.close()
+
+
+class SeenEmployees:
+    '''
+    The consumer's seen-set: employee keys in table salary_seen_employee, claimed in the
+    transaction of the batch that counts them. A batch redelivered after a crash finds
+    its keys committed or not together with its totals, so it is never counted twice.
+    The ON CONFLICT insert is both the lookup and the record, so unlike DedupFilter no
+    in-memory filter is kept; memory does not grow with the number of keys.
+    '''
+    def setup(self, cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS salary_seen_employee (
+                employee_key VARCHAR(64) PRIMARY KEY
+            )
+        """)
+
+    def claim(self, cur, keys):
+        # Record keys and return the ones not seen before, in key order so writers lock alike
+        if not keys:
+            return set()
+        cur.execute("""
+            INSERT INTO salary_seen_employee (employee_key)
+            SELECT unnest(%s::varchar[])
+            ON CONFLICT DO NOTHING
+            RETURNING employee_key
+        """, (sorted(set(keys)),))
+        return {key for (key,) in cur.fetchall()}
+
+    def in_use(self, cur):
+        # True once a consumer has claimed any key (the table may not exist at all)
+        cur.execute("SELECT to_regclass('salary_seen_employee')")
+        if cur.fetchone()[0] is None:
+            return False
+        cur.execute("SELECT EXISTS (SELECT 1 FROM salary_seen_employee)")
+        return cur.fetchone()[0]
+
+    def replace(self, cur, keys):
+        # rebuild.py --dedup: the seen-set becomes exactly the keys the rebuilt totals counted
+        self.setup(cur)
+        cur.execute("DELETE FROM salary_seen_employee")
+        cur.execute("INSERT INTO salary_seen_employee (employee_key) SELECT unnest(%s::varchar[])", (sorted(keys),))
@@ -1,13 +1,134 @@
+import hashlib
 import json
+import struct
+
+import numpy as np
+
+# Message header that selects the value encoding; messages without it are JSON
+codec_header = 'codec'
+json_codec = b'json'
+binary_codec = b'salary-bin-v1'
+
+# Department code table for the binary codec. Producer and consumer must agree on it,
+# so only ever append new departments at the end.
+department_codes = ('AGR', 'AUD', 'CAD', 'CCC', 'CIR', 'CIT', 'CLK', 'CMD', 'COM', 'COR',
+                    'CUL', 'CVB', 'CWA', 'ECC', 'ECO', 'EMS', 'FIN', 'FIR', 'GRD', 'HNP',
+                    'HRD', 'HSD', 'JUV', 'LIB', 'MCC', 'MSB', 'MUS', 'OEM', 'PAR', 'PHD',
+                    'PLN', 'POL', 'PUD', 'PWD', 'REA', 'RMO', 'SHF', 'STR', 'TRE')
+department_index = {dept: code for code, dept in enumerate(department_codes)}
+
+# Fixed 6-byte little-endian layout: uint16 department code, int32 salary
+binary_layout = struct.Struct('<Hi')
+binary_dtype = np.dtype([('dept', '<u2'), ('salary', '<i4')])
+
 
 class Employee:
-    def __init__(self,  emp_dept: str = '', emp_salary: int = 0):
+    # No per-instance __dict__: one object per message adds up on the consumer side
+    __slots__ = ('emp_dept', 'emp_salary', 'emp_division', 'emp_title', 'emp_flsa', 'emp_hire_date', 'emp_pcn')
+
+    def __init__(self,  emp_dept: str = '', emp_salary: int = 0, emp_division: str = None, emp_title: str = None,
+                 emp_flsa: str = None, emp_hire_date: str = None, emp_pcn: str = None):
         self.emp_dept = emp_dept
         self.emp_salary = emp_salary
-        
+        # Rollup and sketch dimensions (producer.py --dimensions); emp_hire_date is YYYY-MM-DD and
+        # only None when the message carries no dimensions at all. emp_pcn is the employee key
+        # from employee_key()
+        self.emp_division = emp_division
+        self.emp_title = emp_title
+        self.emp_flsa = emp_flsa
+        self.emp_hire_date = emp_hire_date
+        self.emp_pcn = emp_pcn
+
     @staticmethod
     def from_csv_line(line):
         return Employee(line[0], line[1])
 
     def to_json(self):
-        return json.dumps(self.__dict__)
+        if self.emp_hire_date is None:
+            return json.dumps({'emp_dept': self.emp_dept, 'emp_salary': self.emp_salary})
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+    def to_bytes(self):
+        # The fixed binary layout has no room for the rollup dimensions
+        return binary_layout.pack(department_index[self.emp_dept], int(self.emp_salary))
+
+    @staticmethod
+    def from_bytes(value):
+        code, salary = binary_layout.unpack(value)
+        return Employee(department_codes[code], salary)
+
+
+class DepartmentAggregate:
+    '''
+    Partial salary aggregate for one department, emitted by the producer combiner.
+    batch_id is unique per department flush so the consumer can drop replays.
+    '''
+    __slots__ = ('emp_dept', 'total_salary', 'emp_count', 'batch_id')
+
+    def __init__(self, emp_dept: str = '', total_salary: int = 0, emp_count: int = 0, batch_id: str = ''):
+        self.emp_dept = emp_dept
+        self.total_salary = total_salary
+        self.emp_count = emp_count
+        self.batch_id = batch_id
+
+    def to_json(self):
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+
+class SalaryChange:
+    '''
+    Keyed change event (producer.py --changes): 'upsert' sets the salary an employee
+    contributes to a department, 'retract' removes it. emp_pcn is the employee key;
+    the consumer turns each event into a delta against the last value for that key.
+    The key includes the department, title and hire date, so an upsert can only correct
+    the salary; moving an employee is a retraction of the old key plus a new upsert.
+    '''
+    __slots__ = ('op', 'emp_pcn', 'emp_dept', 'emp_salary')
+
+    def __init__(self, op: str = 'upsert', emp_pcn: str = '', emp_dept: str = None, emp_salary: int = None):
+        self.op = op
+        self.emp_pcn = emp_pcn
+        self.emp_dept = emp_dept  # None for a retraction
+        self.emp_salary = emp_salary
+
+    def to_json(self):
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+
+def employee_key(pcn, dept, title, hire_date):
+    # Stable employee key "<PCN>#<hash>" from row content, so the same employee gets the same
+    # key in every extract. PCNs are shared by several holders, so the hash of department,
+    # position title and hire date (YYYY-MM-DD) tells them apart. Identical rows are still
+    # different people: DataHandler.transform_dimensions appends -n to the n-th repeat.
+    content = '|'.join(str(value or '').strip().lower() for value in (dept, title, hire_date))
+    return f"{pcn or ''}#{hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+def encode_employees(depts, salaries):
+    '''
+    Bulk binary encoder: packs whole arrays of departments and salaries with numpy
+    and returns one 6-byte message value per record.
+    '''
+    records = np.empty(len(salaries), dtype=binary_dtype)
+    records['dept'] = [department_index[dept] for dept in depts]
+    records['salary'] = salaries
+    buf = records.tobytes()
+    size = binary_dtype.itemsize
+    return [buf[i:i + size] for i in range(0, len(buf), size)]
+
+
+def decode_employees(values):
+    # Bulk binary decoder: list of message values -> structured array with dept/salary fields
+    return np.frombuffer(b''.join(values), dtype=binary_dtype)
+
+
+def decode_record(value, headers=None):
+    # Decode one message value into an Employee, DepartmentAggregate or SalaryChange, based on the codec header
+    if dict(headers or []).get(codec_header) == binary_codec:
+        return Employee.from_bytes(value)
+    payload = json.loads(value)
+    if 'batch_id' in payload:
+        return DepartmentAggregate(**payload)
+    if 'op' in payload:
+        return SalaryChange(**payload)
+    return Employee(**payload)
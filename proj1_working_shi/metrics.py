@@ -0,0 +1,113 @@
+# In-process consumer metrics, served in Prometheus text format (consumer.py --metrics-port)
+
+import bisect
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+size_buckets = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    # Cumulative-bucket histogram as Prometheus expects it; counts[i] is observations <= buckets[i]
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name):
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for le, n in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class ConsumerMetrics:
+    '''
+    Counters, gauges and histograms updated by SalaryConsumer and ConsumingMethods.
+    Records are counted per partition; records/s is rate() over the counter on the
+    Prometheus side. Updates and rendering share one lock, since the HTTP listener
+    reads from its own thread.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = Counter()  # (topic, partition) -> records consumed
+        self.lag = {}  # (topic, partition) -> messages behind the high watermark
+        self.errors = Counter()  # kind -> count
+        self.batch_size = Histogram(size_buckets)
+        self.db_write_seconds = Histogram(latency_buckets)
+        self.poll_to_commit_seconds = Histogram(latency_buckets)
+
+    def observe_records(self, msgs):
+        with self.lock:
+            for msg in msgs:
+                self.records[(msg.topic(), msg.partition())] += 1
+
+    def observe_batch(self, size):
+        with self.lock:
+            self.batch_size.observe(size)
+
+    def observe_db_write(self, seconds):
+        with self.lock:
+            self.db_write_seconds.observe(seconds)
+
+    def observe_commit(self, seconds):
+        with self.lock:
+            self.poll_to_commit_seconds.observe(seconds)
+
+    def set_lag(self, lag):
+        with self.lock:
+            self.lag = dict(lag)
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def render(self):
+        with self.lock:
+            lines = ["# TYPE salary_consumer_records_total counter"]
+            lines += [f'salary_consumer_records_total{{topic="{topic}",partition="{partition}"}} {n}'
+                      for (topic, partition), n in sorted(self.records.items())]
+            lines.append("# TYPE salary_consumer_lag gauge")
+            lines += [f'salary_consumer_lag{{topic="{topic}",partition="{partition}"}} {n}'
+                      for (topic, partition), n in sorted(self.lag.items())]
+            lines.append("# TYPE salary_consumer_errors_total counter")
+            lines += [f'salary_consumer_errors_total{{kind="{kind}"}} {n}' for kind, n in sorted(self.errors.items())]
+            lines += self.batch_size.render('salary_consumer_batch_size')
+            lines += self.db_write_seconds.render('salary_consumer_db_write_seconds')
+            lines += self.poll_to_commit_seconds.render('salary_consumer_poll_to_commit_seconds')
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    # Serve metrics.render() at /metrics from a daemon thread; returns the server (call shutdown() to stop)
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # no access log on stderr for every scrape
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,99 @@
+# Columnar on-disk parse cache for the salary CSVs (producer.py --cache-dir)
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+# Part of every entry's key; bump it when the stored layout changes so old entries miss
+cache_format = 2  # 2: salaries stored as float64, exactly what parse_columns returns
+
+
+class ParseCache:
+    '''
+    Stores the parsed columns of a CSV as NumPy .npy files, one directory per file
+    version, and memory-maps them on later runs instead of parsing the text again.
+    Entries are keyed by path, size and mtime, so any change to the file is a miss;
+    the stale entry for that path is dropped when the new one is written. When the
+    cache grows past max_bytes, the least recently used entries are evicted.
+    '''
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_id(self, csv_path):
+        return hashlib.sha1(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:12]
+
+    def entry_dir(self, csv_path):
+        st = os.stat(csv_path)
+        version = hashlib.sha1(f"{cache_format}:{st.st_size}:{st.st_mtime_ns}".encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"{self.path_id(csv_path)}-{version}")
+
+    def load(self, csv_path):
+        # Returns (department Categorical, salary, hire_year) memory-mapped from disk, or None on a miss
+        entry = self.entry_dir(csv_path)
+        meta_path = os.path.join(entry, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # meta.json mtime is the entry's last use, for LRU eviction
+        os.utime(meta_path)
+        codes = np.load(os.path.join(entry, 'dept_codes.npy'), mmap_mode='r')
+        salary = np.load(os.path.join(entry, 'salary.npy'), mmap_mode='r')
+        hire_year = np.load(os.path.join(entry, 'hire_year.npy'), mmap_mode='r')
+        dept = pd.Categorical.from_codes(codes, meta['departments'])
+        return dept, salary, hire_year
+
+    def store(self, csv_path, dept, salary, hire_year):
+        # Write the output of DataHandler.parse_columns, then return it memory-mapped via load()
+        entry = self.entry_dir(csv_path)
+        dept = pd.Categorical(dept)
+        # Build in a temp directory and rename, so readers never see a half-written entry
+        tmp = f"{entry}.tmp-{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, 'dept_codes.npy'), dept.codes.astype(np.int16))
+        # float64 as parsed: a narrower type could round e.g. 99999.999 up to 100000 before truncation
+        np.save(os.path.join(tmp, 'salary.npy'), np.asarray(salary, dtype=np.float64))
+        # Unparseable hire dates (NaN) are stored as year 0, which never passes the year filter
+        np.save(os.path.join(tmp, 'hire_year.npy'), np.nan_to_num(hire_year, nan=0).astype(np.int16))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'csv': os.path.abspath(csv_path),
+                       'departments': [str(c) for c in dept.categories],
+                       'rows': len(salary),
+                       'created': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+
+        # Older versions of the same CSV can never be hit again
+        prefix = f"{self.path_id(csv_path)}-"
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(prefix) and path != entry:
+                shutil.rmtree(path, ignore_errors=True)
+        self.evict(keep=entry)
+        return self.load(csv_path)
+
+    def evict(self, keep=None):
+        # Remove least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(path, 'meta.json')
+            if not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(meta_path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -23,14 +23,29 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import argparse
 import csv
+import hashlib
+import io
 import json
+import math
+import multiprocessing
 import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 
 from confluent_kafka import Producer
-from employee import Employee
+from checkpoint import IngestCheckpoint
+from compressed import detect_compression, open_input
+from dedup import DedupFilter
+from quality import DataQuality, reject_topic_name
+from parse_cache import ParseCache
+from employee import (DepartmentAggregate, Employee, SalaryChange, binary_codec, codec_header, employee_key,
+                      encode_employees)
 import confluent_kafka
+import numpy as np
 import pandas as pd
 from confluent_kafka.serialization import StringSerializer
 
@@ -38,35 +53,175 @@ from confluent_kafka.serialization import StringSerializer
 employee_topic_name = "bf_employee_salary"
 csv_file = 'Employee_Salaries.csv'
 
+# Business filter shared by every transform path
+departments = ('ECC', 'CIT', 'EMS')  # Only process these 3 departments
+min_hire_year = 2010
+hire_date_format = '%d-%b-%Y'  # e.g. 10-Sep-1984
+
+# Streaming mode only parses the columns the transform needs, with compact dtypes
+csv_columns = ['Department', 'Initial Hire Date', 'Salary']
+# Salary is parsed from text in parse_columns, so one bad value is a reject instead of a read error
+csv_dtypes = {'Department': 'category', 'Initial Hire Date': 'string', 'Salary': 'string'}
+# --dimensions mode also carries the columns the consumer's rollups and sketches group by
+dimension_columns = ['Department', 'Department-Division', 'PCN', 'Position Title', 'FLSA Status', 'Initial Hire Date',
+                     'Salary']
+dimension_dtypes = dict(csv_dtypes, **{'Department-Division': 'string', 'PCN': 'string', 'Position Title': 'string',
+                                       'FLSA Status': 'string'})
+default_chunksize = 100000
+combiner_batch_rows = 100000  # filtered rows per combiner batch; part of the batch ids, so keep it fixed
+default_block_bytes = 8 * 1024 * 1024  # checkpoint mode reads whole lines in blocks of about this size
+
+# Named librdkafka tuning profiles for salaryProducer; 'default' is the original acks=all setup
+producer_profiles = {
+    'default': {'acks': 'all'},
+    # Large, compressed batches and a deep local queue: best msgs/s for one-off loads
+    'bulk-load': {'acks': 'all',
+                  'enable.idempotence': True,
+                  'linger.ms': 100,
+                  'batch.size': 1048576,
+                  'batch.num.messages': 100000,
+                  'compression.type': 'lz4',
+                  'queue.buffering.max.messages': 1000000,
+                  'queue.buffering.max.kbytes': 1048576},
+    # Send immediately and only wait for the leader: lowest per-message delivery latency
+    'low-latency': {'acks': '1',
+                    'linger.ms': 0,
+                    'batch.num.messages': 1,
+                    'compression.type': 'none'},
+    # No loss or duplicates across broker failovers, at some throughput cost
+    'durable': {'acks': 'all',
+                'enable.idempotence': True,
+                'max.in.flight.requests.per.connection': 5,
+                'retries': 2147483647,
+                'delivery.timeout.ms': 300000,
+                'linger.ms': 5,
+                'compression.type': 'zstd'},
+}
+
 #Can use the confluent_kafka.Producer class directly
 class salaryProducer(Producer):
     #if connect without using a docker: host = localhost and port = 29092
     #if connect within a docker container, host = 'kafka' or whatever name used for the kafka container, port = 9092
-    def __init__(self, host="localhost", port="29092"):
+    def __init__(self, host="localhost", port="29092", profile="default", overrides=None):
         self.host = host
         self.port = port
-        producerConfig = {'bootstrap.servers':f"{self.host}:{self.port}",
-                          'acks' : 'all'}
+        self.profile = profile
+        # Profile settings first, then any explicit librdkafka overrides on top
+        producerConfig = {'bootstrap.servers':f"{self.host}:{self.port}"}
+        producerConfig.update(producer_profiles[profile])
+        producerConfig.update(overrides or {})
+        self.config = producerConfig
         super().__init__(producerConfig)
-     
+
+
+def parse_overrides(pairs):
+    # CLI helper: ['linger.ms=20', 'acks=1'] -> {'linger.ms': '20', 'acks': '1'}
+    overrides = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise ValueError(f"expected key=value, got '{pair}'")
+        overrides[key.strip()] = value.strip()
+    return overrides
+
+
+class ByteRangeReader(io.RawIOBase):
+    '''
+    Read-only view of bytes [start, end) of a file, so pandas can parse one shard
+    of a CSV without loading or copying the rest of it.
+    '''
+    def __init__(self, path, start, end):
+        self.f = open(path, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.remaining)
+        if n <= 0:
+            return 0
+        got = self.f.readinto(memoryview(b)[:n])
+        self.remaining -= got
+        return got
+
+    def close(self):
+        self.f.close()
+        super().close()
+
 
 class DataHandler:
     '''
     Your data handling logic goes here. 
     You can also implement the same logic elsewhere. Your call
     '''
-    def __init__(self):
-        pass
+    def __init__(self, cache=None, dedup=None, quality=None):
+        self.cache = cache  # optional ParseCache used by transform_file
+        self.dedup = dedup  # optional DedupFilter applied by transform_dimensions
+        self.quality = quality  # optional DataQuality, run on every chunk parse_columns sees
+        self.duplicates = 0  # rows dropped by the dedup filter
 
     def read_csv(self, csv_file):
-        # Use pandas for efficient CSV parsing and handling
-        df = pd.read_csv(csv_file)
+        # Use pandas for efficient CSV parsing and handling; .gz/.bz2/.zst extracts are
+        # decompressed on the fly (detected from the file's magic bytes)
+        with open_input(csv_file) as f:
+            df = pd.read_csv(f)
         return df
+
+    def read_csv_chunks(self, csv_file, chunksize=default_chunksize):
+        # Iterator of DataFrames of at most chunksize rows, so memory is bounded by the
+        # chunk size instead of the file size and the first chunk is ready right away
+        with open_input(csv_file) as f:
+            yield from pd.read_csv(f, usecols=csv_columns, dtype=csv_dtypes, chunksize=chunksize)
+
+    def require_plain(self, csv_file, mode):
+        # Byte offsets into a compressed file do not map to rows
+        codec = detect_compression(csv_file)
+        if codec is not None:
+            raise ValueError(f"{mode} needs an uncompressed CSV, {csv_file} is {codec} compressed")
+
+    def stream(self, csv_file, chunksize=default_chunksize):
+        # Generator pipeline: parse and transform one chunk at a time, yielding (depts, salaries)
+        for chunk in self.read_csv_chunks(csv_file, chunksize):
+            yield self.transform_columns(chunk)
+
+    def shard_ranges(self, csv_file, num_shards):
+        # Split the data rows (everything after the header) into num_shards byte ranges.
+        # Each boundary is moved forward to the next line start, so no row is cut in two.
+        # Assumes no newlines inside quoted fields, which holds for the salary extracts.
+        self.require_plain(csv_file, 'sharding')
+        size = os.path.getsize(csv_file)
+        with open(csv_file, 'rb') as f:
+            f.readline()
+            data_start = f.tell()
+            bounds = [data_start]
+            for i in range(1, num_shards):
+                f.seek(max(data_start + (size - data_start) * i // num_shards, bounds[-1]))
+                if f.tell() > data_start:
+                    # Step back one byte so a boundary already at a line start is kept
+                    f.seek(f.tell() - 1)
+                    f.readline()
+                bounds.append(f.tell())
+            bounds.append(size)
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def stream_range(self, csv_file, start, end, chunksize=default_chunksize):
+        # Same as stream(), restricted to the rows in bytes [start, end) of the file
+        with open(csv_file, 'r', newline='') as f:
+            header = next(csv.reader([f.readline()]))
+        with io.TextIOWrapper(io.BufferedReader(ByteRangeReader(csv_file, start, end)), newline='') as shard:
+            for chunk in pd.read_csv(shard, header=None, names=header, usecols=csv_columns,
+                                     dtype=csv_dtypes, chunksize=chunksize):
+                yield self.transform_columns(chunk)
         
     def transform(self, df):
         # Filter and transform data based on business requirements
         res = []
-        depts = set(['ECC','CIT','EMS'])  # Only process these 3 departments
+        depts = set(departments)
+        if self.quality is not None:
+            # Rejects are reported by the vectorized rules, not from inside the loop
+            self.parse_columns(df)
         for index, row in df.iterrows():
             dept = row['Department']
             try:
@@ -75,34 +230,602 @@ class DataHandler:
                 hire_year = int(row['Initial Hire Date'].split('-')[2])
             except:
                 # Skip records with null/invalid data to maintain data quality
-                print(f'null found at {index}')
                 continue
             # Filter: only employees hired in 2010 or later from specified departments
-            if dept in depts and hire_year >= 2010:
+            if dept in depts and hire_year >= min_hire_year:
                 res.append([dept, salary])
                 
         return res
 
-if __name__ == '__main__':
-    encoder = StringSerializer('utf-8')
-    reader = DataHandler()
-    producer = salaryProducer()
-    
-    # Read and transform CSV data
-    df = reader.read_csv(csv_file)
-    lines = reader.transform(df)
-    print(f"Total entries to produce: {len(lines)}")
-    
-    # Produce messages to Kafka topic
-    for line in lines:
-        emp = Employee.from_csv_line(line)
+    def stream_blocks(self, csv_file, start=0, block_bytes=default_block_bytes):
+        # Like stream(), but from byte offset start and in blocks of whole lines, yielding
+        # (depts, salaries, end_offset) so callers know exactly which bytes each block covered
+        self.require_plain(csv_file, 'checkpointed reading')
+        with open(csv_file, 'rb') as f:
+            header = next(csv.reader([f.readline().decode('utf-8')]))
+            f.seek(max(start, f.tell()))
+            pending = b''
+            while True:
+                data = f.read(block_bytes)
+                block = pending + data
+                if not data:
+                    # End of file: the last line may have no trailing newline
+                    if not block:
+                        break
+                    cut = len(block)
+                else:
+                    cut = block.rfind(b'\n') + 1
+                    if cut == 0:
+                        # Line longer than block_bytes: keep reading
+                        pending = block
+                        continue
+                pending = block[cut:]
+                df = pd.read_csv(io.BytesIO(block[:cut]), header=None, names=header,
+                                 usecols=csv_columns, dtype=csv_dtypes)
+                depts, salaries = self.transform_columns(df)
+                yield depts, salaries, f.tell() - len(pending)
+
+    def transform_columns(self, df):
+        # Vectorized equivalent of transform(): the filter is one boolean mask built from
+        # column operations instead of a Python loop over df.iterrows()
+        return self.filter_columns(*self.parse_columns(df))
+
+    def parse_columns(self, df):
+        # Text -> typed columns: (department, salary as float with NaN for missing, hire year as float)
+        salary = pd.to_numeric(df['Salary'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        # Bulk parse of DD-Mon-YYYY; unparseable or missing dates become NaT and fail the year test
+        hire_year = pd.to_datetime(df['Initial Hire Date'], format=hire_date_format, errors='coerce').dt.year
+        hire_year = hire_year.to_numpy(dtype='float64', na_value=np.nan)
+        if self.quality is not None:
+            self.quality.check(df, salary, hire_year)
+        return df['Department'], salary, hire_year
+
+    def filter_mask(self, dept, salary, hire_year):
+        # Business filter as one boolean mask; dept may be a Series or a Categorical
+        return (np.asarray(dept.isin(departments))
+                & ~np.isnan(salary)
+                & (hire_year >= min_hire_year))
+
+    def filter_columns(self, dept, salary, hire_year):
+        mask = self.filter_mask(dept, salary, hire_year)
+        # Compact arrays instead of a list of [dept, salary] lists; astype truncates like int()
+        depts = np.asarray(dept[mask], dtype=object)
+        salaries = salary[mask].astype(np.int64)
+        return depts, salaries
+
+    def transform_dimensions(self, df, occurrences=None):
+        # Same filter as transform_columns, keeping the rollup dimensions: a DataFrame of
+        # dimension_columns with int salaries, ISO hire dates and None for missing values,
+        # plus the employee key of each row. occurrences counts each row content seen so far
+        # in the extract (shared by all its chunks), so repeats get keys <PCN>#<hash>-1, -2, ...
+        # With a dedup filter, rows whose key was already produced (e.g. by an overlapping
+        # extract) are dropped.
+        dept, salary, hire_year = self.parse_columns(df)
+        mask = self.filter_mask(dept, salary, hire_year)
+        rows = df[mask]
+        out = pd.DataFrame({'Department': np.asarray(rows['Department'], dtype=object)})
+        for column in ('Department-Division', 'PCN', 'Position Title', 'FLSA Status'):
+            values = rows[column].astype(object)
+            out[column] = values.where(values.notna(), None).to_numpy()
+        hire_date = pd.to_datetime(rows['Initial Hire Date'], format=hire_date_format)
+        out['Initial Hire Date'] = hire_date.dt.strftime('%Y-%m-%d').to_numpy()
+        out['Salary'] = salary[mask].astype(np.int64)
+        occurrences = Counter() if occurrences is None else occurrences
+        keys = []
+        for row in zip(out['PCN'], out['Department'], out['Position Title'], out['Initial Hire Date']):
+            key = employee_key(*row)
+            keys.append(f"{key}-{occurrences[key]}" if occurrences[key] else key)
+            occurrences[key] += 1
+        out['Key'] = keys
+        if self.dedup is not None:
+            new = self.dedup.new_mask(out['Key'])
+            self.duplicates += int(np.count_nonzero(~new))
+            out = out[new].reset_index(drop=True)
+            self.dedup.add(out['Key'].tolist())
+        return out
+
+    def stream_dimensions(self, csv_file, chunksize=default_chunksize):
+        # stream() for --dimensions mode, yielding transform_dimensions frames
+        occurrences = Counter()
+        with open_input(csv_file) as f:
+            for chunk in pd.read_csv(f, usecols=dimension_columns, dtype=dimension_dtypes, chunksize=chunksize):
+                yield self.transform_dimensions(chunk, occurrences)
+
+    def transform_file(self, csv_file):
+        # Whole-file transform; with a parse cache, repeat runs skip CSV text parsing entirely
+        if self.cache is None:
+            return self.transform_columns(self.read_csv(csv_file))
+        columns = self.cache.load(csv_file)
+        if columns is None:
+            with open_input(csv_file) as f:
+                df = pd.read_csv(f, usecols=csv_columns, dtype=csv_dtypes)
+            columns = self.cache.store(csv_file, *self.parse_columns(df))
+        return self.filter_columns(*columns)
+
+def source_fingerprint(path):
+    # Short stable id of an input file: same path, size and mtime -> same id
+    st = os.stat(path)
+    raw = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+class SalaryCombiner:
+    '''
+    Producer-side combiner: sums salaries and counts rows per department, then each flush
+    emits one DepartmentAggregate per department instead of one message per employee.
+    Batches cover fixed ranges of batch_rows filtered rows, whatever the chunk size or
+    window, and their ids are "<source id>-r<first row>-<end row>". Re-producing the same
+    input therefore yields the same batches under the same ids, and the consumer skips
+    the ones it has already applied. The window only decides when finished batches are
+    sent; the last, partial batch is sent by flush(final=True) at the end of the input.
+    '''
+    def __init__(self, source_id, window_seconds=0, batch_rows=combiner_batch_rows):
+        self.source_id = source_id
+        self.window_seconds = window_seconds  # 0 = send finished batches after every chunk
+        self.batch_rows = batch_rows
+        self.rows = 0  # filtered rows added so far
+        self.totals = {}  # partials of the batch being filled
+        self.counts = {}
+        self.ready = []  # finished batches not yet sent
+        self.window_start = time.monotonic()
+
+    def add(self, depts, salaries):
+        # Split the chunk at batch boundaries, then group-by-sum each piece into its batch
+        pos = 0
+        while pos < len(depts):
+            take = min(len(depts) - pos, self.batch_rows - self.rows % self.batch_rows)
+            grouped = pd.Series(salaries[pos:pos + take]).groupby(depts[pos:pos + take]).agg(['sum', 'count'])
+            for dept, total, count in zip(grouped.index, grouped['sum'].tolist(), grouped['count'].tolist()):
+                self.totals[dept] = self.totals.get(dept, 0) + total
+                self.counts[dept] = self.counts.get(dept, 0) + count
+            pos += take
+            self.rows += take
+            if self.rows % self.batch_rows == 0:
+                self.close_batch()
+
+    def close_batch(self):
+        first = (self.rows - 1) // self.batch_rows * self.batch_rows
+        batch_id = f"{self.source_id}-r{first}-{self.rows}"
+        self.ready.extend(DepartmentAggregate(dept, self.totals[dept], self.counts[dept], batch_id)
+                          for dept in sorted(self.totals))
+        self.totals = {}
+        self.counts = {}
+
+    def due(self):
+        return time.monotonic() - self.window_start >= self.window_seconds
+
+    def flush(self, final=False):
+        # Finished batches, plus the partial one at the end of the input
+        if final and self.totals:
+            self.close_batch()
+        aggs = self.ready
+        self.ready = []
+        self.window_start = time.monotonic()
+        return aggs
+
+
+class LatencyHistogram:
+    '''
+    Delivery latencies counted in fixed log-spaced buckets, each 2% wider than the last,
+    from 10 us to about 100 s. Memory stays the same however many messages a run sends,
+    and percentiles come back within a bucket's width. Histograms from several producers
+    (produce_sharded workers) combine with merge().
+    '''
+    lowest = 1e-5
+    growth = 1.02
+    size = math.ceil(math.log(1e7) / math.log(growth)) + 2  # slot 0 is below lowest, the last one is the overflow
+
+    def __init__(self):
+        self.counts = np.zeros(self.size, dtype=np.int64)
+
+    def observe(self, seconds):
+        slot = 0 if seconds < self.lowest else int(math.log(seconds / self.lowest) / math.log(self.growth)) + 1
+        self.counts[min(slot, self.size - 1)] += 1
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def percentiles(self, qs):
+        # Geometric middle of the bucket holding each percentile, in seconds (NaN when empty)
+        total = len(self)
+        if not total:
+            return [float('nan')] * len(qs)
+        cumulative = np.cumsum(self.counts)
+        slots = [int(np.searchsorted(cumulative, max(1, math.ceil(q / 100 * total)))) for q in qs]
+        return [self.lowest if slot == 0 else self.lowest * self.growth ** (slot - 0.5) for slot in slots]
+
+
+class PipelinedSender:
+    '''
+    Non-blocking produce path. Keeps up to max_in_flight messages outstanding, services
+    delivery callbacks with poll(0) instead of waiting on every record, and retries when
+    librdkafka's local queue is full. Delivery results are tallied per partition.
+    '''
+    def __init__(self, producer, max_in_flight=100000):
+        self.producer = producer
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.delivered = Counter()  # partition -> delivered count
+        self.failed = Counter()  # partition -> failed count
+        self.failed_keys = Counter()
+        self.latencies = LatencyHistogram()  # seconds from produce() to delivery report
+        self.start = time.perf_counter()
+
+    def send(self, topic, key, value, headers=None):
+        # Bounded window: serve delivery reports until there is room for one more message
+        while self.in_flight >= self.max_in_flight:
+            self.producer.poll(0.05)
+        sent_at = time.perf_counter()
+        while True:
+            try:
+                self.producer.produce(topic, key=key, value=value, headers=headers,
+                                      on_delivery=lambda err, msg: self.on_delivery(err, msg, sent_at))
+                break
+            except BufferError:
+                # Local queue is full: let librdkafka drain some deliveries, then retry
+                self.producer.poll(0.1)
+        self.in_flight += 1
+        self.sent += 1
+        self.sent_bytes += len(value)
+        self.producer.poll(0)
+
+    def on_delivery(self, err, msg, sent_at):
+        self.in_flight -= 1
+        if err is not None:
+            self.failed[msg.partition()] += 1
+            self.failed_keys[msg.key().decode('utf-8') if msg.key() else None] += 1
+        else:
+            self.delivered[msg.partition()] += 1
+            self.latencies.observe(time.perf_counter() - sent_at)
+
+    def flush(self, timeout=-1):
+        # Returns the number of messages still undelivered when the timeout expires
+        return self.producer.flush(timeout)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start
+        p50, p99 = self.latencies.percentiles([50, 99])
+        return {'sent': self.sent,
+                'delivered': sum(self.delivered.values()),
+                'failed': sum(self.failed.values()),
+                'elapsed_s': elapsed,
+                'msgs_per_s': self.sent / elapsed if elapsed else 0.0,
+                'bytes_per_s': self.sent_bytes / elapsed if elapsed else 0.0,
+                'p50_ms': p50 * 1000,
+                'p99_ms': p99 * 1000,
+                'partitions': {p: {'delivered': self.delivered[p], 'failed': self.failed[p]}
+                               for p in sorted(set(self.delivered) | set(self.failed))},
+                'failed_keys': dict(self.failed_keys)}
+
+    def report(self):
+        return print_report(self.stats())
+
+
+def print_report(stats):
+    print(f"Sent {stats['sent']} messages in {stats['elapsed_s']:.2f}s "
+          f"({stats['msgs_per_s']:,.0f} msgs/s, {stats['bytes_per_s'] / 1e6:.2f} MB/s)")
+    print(f"Delivered {stats['delivered']}, failed {stats['failed']}, "
+          f"latency p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+    for partition, counts in stats['partitions'].items():
+        print(f"  partition {partition}: delivered {counts['delivered']}, failed {counts['failed']}")
+    if stats['failed_keys']:
+        print(f"Failed keys: {stats['failed_keys']}")
+    return stats
+
+
+def produce_records(sender, encoder, depts, salaries, codec='json', topic=employee_topic_name):
+    # Produce one message per employee record, returns how many were produced
+    if codec == 'binary':
+        # Bulk-encode the whole chunk; the codec header tells the consumer how to decode it
+        headers = [(codec_header, binary_codec)]
+        for dept, value in zip(depts, encode_employees(depts, salaries)):
+            sender.send(topic, encoder(dept), value, headers)
+        return len(depts)
+    for dept, salary in zip(depts, salaries.tolist()):
+        emp = Employee(dept, salary)
         # Use department as key for partitioning - ensures same dept goes to same partition
         # This enables parallel processing by consumer groups and maintains order per department
-        producer.produce(employee_topic_name, key=encoder(emp.emp_dept), value=encoder(emp.to_json()))
-        # Poll to handle delivery callbacks and keep connection alive
-        producer.poll(1)
-    
-    # Flush ensures all messages are sent before exiting
-    producer.flush()
-    print(f"Successfully produced {len(lines)} messages to topic '{employee_topic_name}'")
-    
\ No newline at end of file
+        sender.send(topic, encoder(emp.emp_dept), encoder(emp.to_json()))
+    return len(depts)
+
+def produce_dimension_records(sender, encoder, frame, topic=employee_topic_name):
+    # produce_records for a transform_dimensions frame: JSON employees with their rollup dimensions
+    for dept, division, key, title, flsa, hire_date, salary in zip(
+            frame['Department'], frame['Department-Division'], frame['Key'], frame['Position Title'],
+            frame['FLSA Status'], frame['Initial Hire Date'], frame['Salary'].tolist()):
+        emp = Employee(dept, salary, division, title, flsa, hire_date, key)
+        sender.send(topic, encoder(dept), encoder(emp.to_json()))
+    return len(frame)
+
+def produce_changes(sender, encoder, frame, topic=employee_topic_name):
+    # One upsert event per row of a transform_dimensions frame, keyed by employee key so that
+    # every change to one employee lands on one partition, in order. The key hashes department,
+    # title and hire date, so only salary corrections update an existing key; correcting any
+    # of those fields produces a new key, and the old one must be retracted (--retract).
+    for key, dept, salary in zip(frame['Key'], frame['Department'], frame['Salary'].tolist()):
+        sender.send(topic, encoder(key), encoder(SalaryChange('upsert', key, dept, salary).to_json()))
+    return len(frame)
+
+def produce_retractions(sender, encoder, keys, topic=employee_topic_name):
+    # Remove employees (by change key) from the totals they were last counted in
+    for key in keys:
+        sender.send(topic, encoder(key), encoder(SalaryChange('retract', key).to_json()))
+    return len(keys)
+
+def produce_aggregates(sender, encoder, aggs, topic=employee_topic_name):
+    # Same keying as produce_records, so a department's partials stay on one partition
+    for agg in aggs:
+        sender.send(topic, encoder(agg.emp_dept), encoder(agg.to_json()))
+    return len(aggs)
+
+def snapshot_delivered(frames, sender, dedup):
+    # Pass transform_dimensions frames through, and between two frames, once the dedup filter's
+    # snapshot is due, wait until everything sent so far is delivered and snapshot its keys.
+    # A crash then only re-produces the rows after the last snapshot; after a failed delivery
+    # nothing more is snapshotted, so a rerun produces the undelivered rows again.
+    for frame in frames:
+        yield frame
+        if dedup.due() and not sum(sender.failed.values()):
+            sender.flush()
+            if not sum(sender.failed.values()):
+                dedup.snapshot()
+
+def produce_chunks(sender, encoder, chunks, combiner=None, codec='json', topic=employee_topic_name):
+    # Drive (depts, salaries) chunks through the per-record or the combiner path
+    total = 0
+    for depts, salaries in chunks:
+        if combiner is None:
+            total += produce_records(sender, encoder, depts, salaries, codec, topic)
+        else:
+            combiner.add(depts, salaries)
+            if combiner.due():
+                total += produce_aggregates(sender, encoder, combiner.flush(), topic)
+    if combiner is not None:
+        total += produce_aggregates(sender, encoder, combiner.flush(final=True), topic)
+    return total
+
+def produce_incremental(sender, encoder, csv_path, checkpoint, block_bytes=default_block_bytes,
+                        combine=False, codec='json', reader=None):
+    '''
+    Checkpointed ingestion: resume at the checkpoint offset and, after each block, wait
+    for delivery of all of its messages before moving the checkpoint past it. A crash
+    repeats at most the block in flight; an appended file only produces the new rows.
+    '''
+    start = checkpoint.resume_offset(csv_path)
+    if start:
+        print(f"Resuming {csv_path} at byte {start}")
+    if combine:
+        checkpoint.bind_block_bytes(csv_path, block_bytes)
+    total = 0
+    block_start = start
+    for depts, salaries, end in (reader or DataHandler()).stream_blocks(csv_path, start, block_bytes):
+        failed_before = sum(sender.failed.values())
+        if not combine:
+            produced = produce_records(sender, encoder, depts, salaries, codec)
+        else:
+            # One combiner per block: batch ids carry the block's byte range, so a replayed
+            # block reuses the ids of the failed one (bind_block_bytes keeps the size fixed)
+            combiner = SalaryCombiner(f"{checkpoint.file_id(csv_path)}-b{block_start}-{end}")
+            combiner.add(depts, salaries)
+            produced = produce_aggregates(sender, encoder, combiner.flush(final=True))
+        if sender.flush() > 0 or sum(sender.failed.values()) > failed_before:
+            raise RuntimeError(f"delivery failed for the block ending at byte {end}, "
+                               f"checkpoint left at byte {checkpoint.state.get('offset', 0)}")
+        checkpoint.save(csv_path, end, produced)
+        total += produced
+        block_start = end
+    return total
+
+def produce_shard(csv_path, start, end, chunksize, combine, window, max_in_flight, codec,
+                  producer_kwargs=None):
+    # Worker process entry point: its own producer and sender for one byte range of the CSV
+    sender = PipelinedSender(salaryProducer(**(producer_kwargs or {})), max_in_flight)
+    quality = DataQuality()
+    chunks = DataHandler(quality=quality).stream_range(csv_path, start, end, chunksize)
+    # The shard's byte range in the batch id keeps combiner batches unique across workers,
+    # and identical for a rerun with the same number of workers
+    combiner = SalaryCombiner(f"{source_fingerprint(csv_path)}-b{start}-{end}", window) if combine else None
+    produce_chunks(sender, StringSerializer('utf-8'), chunks, combiner, codec)
+    sender.flush()
+    stats = sender.stats()
+    stats['latencies'] = sender.latencies
+    stats['checked_rows'] = quality.rows
+    stats['rejects'] = dict(quality.counts)
+    return stats
+
+def produce_sharded(csv_path, workers, chunksize=default_chunksize, combine=False, window=0, max_in_flight=100000,
+                    codec='json', producer_kwargs=None):
+    # Fan byte-range shards out to worker processes and combine their delivery stats.
+    # spawn, not fork: librdkafka threads do not survive a fork
+    start_time = time.perf_counter()
+    shards = DataHandler().shard_ranges(csv_path, workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(produce_shard, csv_path, start, end, chunksize, combine, window,
+                               max_in_flight, codec, producer_kwargs)
+                   for start, end in shards]
+        results = [future.result() for future in futures]
+    return combine_stats(results, time.perf_counter() - start_time)
+
+def combine_stats(results, elapsed):
+    # Merge per-shard PipelinedSender stats into one summary over the parent's wall time
+    partitions = {}
+    failed_keys = Counter()
+    rejects = Counter()
+    latencies = LatencyHistogram()
+    for res in results:
+        for p, counts in res['partitions'].items():
+            merged = partitions.setdefault(p, {'delivered': 0, 'failed': 0})
+            merged['delivered'] += counts['delivered']
+            merged['failed'] += counts['failed']
+        failed_keys.update(res['failed_keys'])
+        rejects.update(res['rejects'])
+        latencies.merge(res['latencies'])
+    p50, p99 = latencies.percentiles([50, 99])
+    sent = sum(res['sent'] for res in results)
+    sent_bytes = sum(res['bytes_per_s'] * res['elapsed_s'] for res in results)
+    return {'sent': sent,
+            'delivered': sum(res['delivered'] for res in results),
+            'failed': sum(res['failed'] for res in results),
+            'elapsed_s': elapsed,
+            'msgs_per_s': sent / elapsed if elapsed else 0.0,
+            'bytes_per_s': sent_bytes / elapsed if elapsed else 0.0,
+            'p50_ms': p50 * 1000,
+            'p99_ms': p99 * 1000,
+            'partitions': dict(sorted(partitions.items())),
+            'failed_keys': dict(failed_keys),
+            'checked_rows': sum(res['checked_rows'] for res in results),
+            'rejects': dict(rejects),
+            'shards': len(results)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Produce filtered employee salaries to Kafka')
+    parser.add_argument('--csv', default=csv_file,
+                        help='salary extract; gzip, bzip2 and zstd compressed files are detected and streamed')
+    parser.add_argument('--chunksize', type=int, default=0,
+                        help='stream the CSV in chunks of this many rows (0 = load the whole file)')
+    parser.add_argument('--combine', action='store_true',
+                        help='pre-aggregate salaries per department and produce one record per department per flush')
+    parser.add_argument('--window', type=float, default=0,
+                        help='with --combine, flush at most every this many seconds (0 = flush every chunk)')
+    parser.add_argument('--max-in-flight', type=int, default=100000,
+                        help='maximum number of produced but not yet acknowledged messages')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='split the CSV into this many byte-range shards, one producer process each')
+    parser.add_argument('--codec', choices=['json', 'binary'], default='json',
+                        help='employee message encoding; binary is a 6-byte fixed layout flagged by a header')
+    parser.add_argument('--profile', choices=sorted(producer_profiles), default='default',
+                        help='librdkafka tuning profile')
+    parser.add_argument('--set', dest='overrides', action='append', metavar='KEY=VALUE',
+                        help='librdkafka setting applied on top of the profile, can be repeated')
+    parser.add_argument('--checkpoint', metavar='PATH',
+                        help='resumable mode: only produce rows after the offset stored in this checkpoint file')
+    parser.add_argument('--block-bytes', type=int, default=default_block_bytes,
+                        help='with --checkpoint, bytes of CSV produced and confirmed per checkpoint update')
+    parser.add_argument('--cache-dir',
+                        help='keep a memory-mapped columnar copy of parsed CSVs here and reuse it on later runs')
+    parser.add_argument('--cache-max-mb', type=int, default=1024,
+                        help='evict least recently used parse cache entries above this total size')
+    parser.add_argument('--changes', action='store_true',
+                        help='send upsert events keyed per employee (PCN and row content), so re-sending an extract with '
+                             'corrected salaries adjusts the totals instead of adding to them; a corrected department, '
+                             'title or hire date is a new key, so --retract the old one')
+    parser.add_argument('--retract', action='append', metavar='KEY',
+                        help='send a retraction for this employee key (<PCN>#<hash>[-n], as sent by --changes), '
+                             'can be repeated')
+    parser.add_argument('--dimensions', action='store_true',
+                        help='also send division, PCN, position title, FLSA status and hire date '
+                             'for the consumer rollups and sketches')
+    parser.add_argument('--dedup', metavar='PATH',
+                        help='skip employees (by employee key) already produced by an earlier run or overlapping '
+                             'extract; the seen-set snapshot is kept at PATH')
+    parser.add_argument('--dedup-capacity', type=int, default=1000000,
+                        help='with --dedup, keys the first Bloom filter is sized for before it grows')
+    parser.add_argument('--dedup-interval', type=float, default=60.0,
+                        help='with --dedup, seconds between snapshots of the delivered keys during a run')
+    parser.add_argument('--reject-file', metavar='PATH',
+                        help='append rows failing the data-quality rules to this CSV, with a reason column')
+    parser.add_argument('--reject-topic', nargs='?', const=reject_topic_name, metavar='TOPIC',
+                        help=f"send rows failing the data-quality rules to this dead-letter topic "
+                             f"(default: {reject_topic_name})")
+    args = parser.parse_args()
+    if (args.workers > 1 or args.checkpoint) and detect_compression(args.csv):
+        parser.error('--workers and --checkpoint read byte offsets and need an uncompressed CSV')
+    if (args.reject_file or args.reject_topic) and (args.workers > 1 or args.cache_dir):
+        # Workers only report counts; a parse cache hit skips the rules
+        parser.error('--reject-file and --reject-topic cannot be combined with --workers or --cache-dir')
+    if args.checkpoint and args.workers > 1:
+        parser.error('--checkpoint cannot be combined with --workers')
+    if args.changes and args.dimensions:
+        parser.error('--changes cannot be combined with --dimensions')
+    if (args.dimensions or args.changes or args.retract) and \
+            (args.combine or args.codec != 'json' or args.workers > 1 or args.checkpoint or args.cache_dir):
+        parser.error('--dimensions, --changes and --retract only support JSON per-record mode '
+                     '(no --combine, --codec binary, --workers, --checkpoint or --cache-dir)')
+    if args.dedup and (args.changes or args.workers > 1 or args.checkpoint or args.cache_dir):
+        parser.error('--dedup cannot be combined with --changes, --workers, --checkpoint or --cache-dir')
+    try:
+        producer_kwargs = {'profile': args.profile, 'overrides': parse_overrides(args.overrides)}
+    except ValueError as err:
+        parser.error(str(err))
+
+    if args.workers > 1:
+        # Sharded mode: the parent only splits the file, each worker produces its own shard
+        stats = produce_sharded(args.csv, args.workers, args.chunksize or default_chunksize,
+                                args.combine, args.window, args.max_in_flight, args.codec, producer_kwargs)
+        print(f"Produced {stats['sent']} messages to topic '{employee_topic_name}' from {stats['shards']} shards")
+        print_report(stats)
+        quality = DataQuality()
+        quality.rows = stats['checked_rows']
+        quality.counts.update(stats['rejects'])
+        print(quality.summary())
+    else:
+        encoder = StringSerializer('utf-8')
+        cache = ParseCache(args.cache_dir, args.cache_max_mb * 1024 * 1024) if args.cache_dir else None
+        dedup = DedupFilter(args.dedup, args.dedup_capacity, snapshot_interval=args.dedup_interval) \
+            if args.dedup else None
+        producer = salaryProducer(**producer_kwargs)
+        sender = PipelinedSender(producer, args.max_in_flight)
+        quality = DataQuality(args.reject_file, sender if args.reject_topic else None, args.reject_topic)
+        reader = DataHandler(cache, dedup, quality)
+
+        if args.changes or args.retract:
+            total = 0
+            if args.changes:
+                if args.chunksize > 0:
+                    frames = reader.stream_dimensions(args.csv, args.chunksize)
+                else:
+                    frames = [reader.transform_dimensions(reader.read_csv(args.csv))]
+                total += sum(produce_changes(sender, encoder, frame) for frame in frames)
+            total += produce_retractions(sender, encoder, args.retract or [])
+        elif args.dimensions:
+            if args.chunksize > 0:
+                frames = reader.stream_dimensions(args.csv, args.chunksize)
+            else:
+                frames = [reader.transform_dimensions(reader.read_csv(args.csv))]
+            if dedup is not None:
+                frames = snapshot_delivered(frames, sender, dedup)
+            total = sum(produce_dimension_records(sender, encoder, frame) for frame in frames)
+        elif args.checkpoint:
+            try:
+                total = produce_incremental(sender, encoder, args.csv, IngestCheckpoint(args.checkpoint),
+                                            args.block_bytes, args.combine, args.codec, reader)
+            except ValueError as err:
+                parser.error(str(err))
+        else:
+            if dedup is not None:
+                # Dedup needs the PCN, so parse the dimension columns and keep (depts, salaries)
+                if args.chunksize > 0:
+                    frames = reader.stream_dimensions(args.csv, args.chunksize)
+                else:
+                    frames = [reader.transform_dimensions(reader.read_csv(args.csv))]
+                if not args.combine:
+                    # Combined rows wait in the combiner, unsent, so only the final snapshot is safe
+                    frames = snapshot_delivered(frames, sender, dedup)
+                chunks = ((np.asarray(f['Department'], dtype=object), f['Salary'].to_numpy()) for f in frames)
+            elif args.chunksize > 0:
+                # Streaming mode: each chunk is produced as soon as it is parsed
+                chunks = reader.stream(args.csv, args.chunksize)
+            else:
+                chunks = [reader.transform_file(args.csv)]
+            # Combiner mode: one partial aggregate per department per flush
+            combiner = SalaryCombiner(source_fingerprint(args.csv), args.window) if args.combine else None
+            total = produce_chunks(sender, encoder, chunks, combiner, args.codec)
+
+        # Flush ensures all messages are sent before exiting
+        sender.flush()
+        print(f"Produced {total} messages to topic '{employee_topic_name}'")
+        sender.report()
+        if quality.rows:
+            # Zero rows checked means a parse cache hit: the rules ran when the entry was built
+            print(quality.summary())
+        if dedup is not None:
+            # The final snapshot, under the same rule as snapshot_delivered
+            if not sum(sender.failed.values()):
+                dedup.snapshot()
+            print(f"Skipped {reader.duplicates} employees already produced")
+            dedup.close()
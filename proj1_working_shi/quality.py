@@ -0,0 +1,75 @@
+# Vectorized data-quality rules for the salary extracts, with a reject file / dead-letter topic (producer.py)
+
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from employee import department_codes
+
+# Reason code -> description, in the order rules are applied; a row gets the first reason that matches
+quality_rules = {
+    'missing_department': 'Department is empty',
+    'unknown_department': 'Department is not in employee.department_codes',
+    'missing_salary': 'Salary is empty',
+    'bad_salary': 'Salary is not a number',
+    'missing_hire_date': 'Initial Hire Date is empty',
+    'bad_hire_date': 'Initial Hire Date is not DD-Mon-YYYY',
+}
+reject_topic_name = "bf_employee_salary_rejects"
+
+
+class DataQuality:
+    '''
+    Runs quality_rules over each parsed chunk as column masks and counts rejected rows
+    per reason. Rows of departments the producer does not load are checked too, since
+    the report is about the extract. With reject_path, rejected rows are appended to
+    that CSV with a reason column; with a sender, each one is also sent as JSON to
+    reject_topic, keyed by reason. Nothing is printed per row; see summary().
+    '''
+    def __init__(self, reject_path=None, sender=None, reject_topic=reject_topic_name):
+        self.reject_path = reject_path
+        self.sender = sender  # PipelinedSender for the dead-letter topic
+        self.reject_topic = reject_topic
+        self.rows = 0
+        self.counts = Counter()
+        self.header_written = reject_path is not None and os.path.exists(reject_path) \
+            and os.path.getsize(reject_path) > 0
+
+    def reasons(self, df, salary, hire_year):
+        # Reason code per row (None for a good row). salary and hire_year are the parsed
+        # columns from DataHandler.parse_columns, NaN where the text did not parse.
+        dept = pd.Series(np.asarray(df['Department'], dtype=object), index=df.index)
+        missing_dept = dept.isna().to_numpy()
+        # Known means encodable: the binary codec has no code for anything else
+        bad_dept = ~missing_dept & ~dept.isin(department_codes).to_numpy()
+        missing_salary = df['Salary'].isna().to_numpy()
+        missing_hire = df['Initial Hire Date'].isna().to_numpy()
+        masks = [missing_dept, bad_dept,
+                 missing_salary, ~missing_salary & np.isnan(salary),
+                 missing_hire, ~missing_hire & np.isnan(hire_year)]
+        return np.select(masks, list(quality_rules), default=None)
+
+    def check(self, df, salary, hire_year):
+        reasons = self.reasons(df, salary, hire_year)
+        self.rows += len(df)
+        rejected = pd.notna(reasons)
+        if not rejected.any():
+            return
+        self.counts.update(reasons[rejected].tolist())
+        rejects = df[rejected].assign(reason=reasons[rejected])
+        if self.reject_path is not None:
+            rejects.to_csv(self.reject_path, mode='a', header=not self.header_written, index=False)
+            self.header_written = True
+        if self.sender is not None:
+            for reason, record in zip(rejects['reason'], rejects.to_json(orient='records', lines=True).splitlines()):
+                self.sender.send(self.reject_topic, reason.encode('utf-8'), record.encode('utf-8'))
+
+    def summary(self):
+        # Table of rejected rows per rule, for the end of a producer run
+        lines = [f"Data quality: {sum(self.counts.values())} of {self.rows} rows rejected",
+                 f"  {'rule':<20}  {'rows':>8}  description"]
+        for code, description in quality_rules.items():
+            lines.append(f"  {code:<20}  {self.counts[code]:>8}  {description}")
+        return '\n'.join(lines)
@@ -0,0 +1,295 @@
+# Rebuild department_employee_salary from the whole topic, one process per partition (python rebuild.py)
+# Stop the streaming consumers first: the rebuild replaces their totals and hands them new offsets.
+
+import argparse
+import io
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import psycopg2.extras
+from confluent_kafka import Consumer, KafkaException, TopicPartition
+
+from consumer import SalaryConsumer, SalaryDatabase
+from dedup import SeenEmployees
+from employee import (DepartmentAggregate, SalaryChange, binary_codec, codec_header, decode_employees, decode_record,
+                      department_codes)
+from producer import employee_topic_name
+from rollup import SalaryRollup, parse_rollup
+from sketches import DepartmentSketches
+
+
+def sum_json(values):
+    # Vectorized decode of a batch of JSON values: one pandas parse, then group-by sums.
+    # Returns (employee totals per department, combiner aggregates by (batch_id, department),
+    # last change event per key as (department, salary), or None once retracted)
+    df = pd.read_json(io.BytesIO(b'\n'.join(values)), lines=True, dtype=False, convert_dates=False)
+    totals, aggs, changes = Counter(), {}, {}
+    is_agg = df['batch_id'].notna().to_numpy() if 'batch_id' in df else np.zeros(len(df), dtype=bool)
+    is_change = df['op'].notna().to_numpy() if 'op' in df else np.zeros(len(df), dtype=bool)
+    employees = df[~is_agg & ~is_change]
+    if len(employees):
+        # int(float(salary)) per record in the streaming consumer: truncate before summing
+        salaries = np.trunc(pd.to_numeric(employees['emp_salary']).to_numpy(dtype=np.float64)).astype(np.int64)
+        for dept, total in pd.Series(salaries).groupby(employees['emp_dept'].to_numpy()).sum().items():
+            totals[dept] += int(total)
+    if is_agg.any():
+        columns = ['batch_id', 'emp_dept', 'total_salary', 'emp_count']
+        for batch_id, dept, total, count in df.loc[is_agg, columns].itertuples(index=False):
+            aggs.setdefault((batch_id, dept), (int(total), int(count)))
+    if is_change.any():
+        columns = ['op', 'emp_pcn', 'emp_dept', 'emp_salary']
+        for op, pcn, dept, salary in df.loc[is_change, columns].itertuples(index=False):
+            changes[pcn] = (dept, int(float(salary))) if op == 'upsert' else None
+    return totals, aggs, changes
+
+
+def sum_binary(values):
+    # Binary batch: department codes index straight into a bincount of salaries
+    records = decode_employees(values)
+    counts = np.bincount(records['dept'], minlength=len(department_codes))
+    sums = np.bincount(records['dept'], weights=records['salary'], minlength=len(department_codes))
+    return Counter({department_codes[code]: int(sums[code]) for code in np.flatnonzero(counts)})
+
+
+class EmployeeReplay:
+    '''
+    What the streaming consumers did per employee besides adding to the totals, redone
+    by the rebuild for one partition. With dedup only the first copy of each employee key
+    counts, as with consumer.py --dedup. Every copy of a key lands on one partition (the
+    key includes the department, and the producer keys messages by department), so the
+    partitions can be deduplicated independently and their seen keys simply combined.
+    The employees that count also feed the --rollup groups and the --sketches, which
+    merge across partitions like the consumers' own do.
+    '''
+    def __init__(self, dedup=False, rollups=(), sketches=False):
+        self.seen = set() if dedup else None
+        self.rollups = [SalaryRollup(dims) for dims in rollups]
+        self.sketches = DepartmentSketches() if sketches else None
+
+    def add(self, employees):
+        # Employees to count, in offset order; those without a key always count
+        if self.seen is not None:
+            kept = []
+            for e in employees:
+                if e.emp_pcn is None:
+                    kept.append(e)
+                elif e.emp_pcn not in self.seen:
+                    self.seen.add(e.emp_pcn)
+                    kept.append(e)
+            employees = kept
+        if self.rollups:
+            # As RollupCube.write: employees without dimensions are left out
+            for e in employees:
+                if e.emp_hire_date is not None:
+                    salary = int(float(e.emp_salary))
+                    for rollup in self.rollups:
+                        rollup.add(e, salary)
+        if self.sketches is not None:
+            self.sketches.add(employees)
+        return employees
+
+    def merge(self, other):
+        if self.seen is not None:
+            self.seen |= other.seen
+        for rollup, other_rollup in zip(self.rollups, other.rollups):
+            rollup.merge(other_rollup)
+        if self.sketches is not None:
+            self.sketches.merge(other.sketches)
+
+
+def sum_batch(msgs, replay=None):
+    # Split a batch by codec and sum each part in bulk; a batch with a bad JSON value falls back
+    # to decoding one message at a time and skips the undecodable ones, like the streaming consumer.
+    # With an EmployeeReplay every message is decoded, since the replay needs each employee.
+    if replay is not None:
+        return sum_records(msgs, replay)
+    binary = [msg.value() for msg in msgs if dict(msg.headers() or []).get(codec_header) == binary_codec]
+    text = [msg for msg in msgs if dict(msg.headers() or []).get(codec_header) != binary_codec]
+    totals = sum_binary(binary) if binary else Counter()
+    aggs, changes = {}, {}
+    if not text:
+        return totals, aggs, changes
+    try:
+        text_totals, aggs, changes = sum_json([msg.value() for msg in text])
+    except ValueError:
+        text_totals, aggs, changes = sum_records(text)
+    totals.update(text_totals)
+    return totals, aggs, changes
+
+
+def sum_records(msgs, replay=None):
+    # sum_batch one message at a time, skipping undecodable ones; employees go through the replay
+    totals, aggs, changes, employees = Counter(), {}, {}, []
+    for msg in msgs:
+        try:
+            record = decode_record(msg.value(), msg.headers())
+        except Exception as err:
+            print(f"Skipping undecodable message at {msg.topic()}[{msg.partition()}]@{msg.offset()}: {err}")
+            continue
+        if isinstance(record, DepartmentAggregate):
+            aggs.setdefault((record.batch_id, record.emp_dept), (int(record.total_salary), int(record.emp_count)))
+        elif isinstance(record, SalaryChange):
+            changes[record.emp_pcn] = ((record.emp_dept, int(float(record.emp_salary)))
+                                       if record.op == 'upsert' else None)
+        else:
+            employees.append(record)
+    if replay is not None:
+        employees = replay.add(employees)
+    for e in employees:
+        totals[e.emp_dept] += int(float(e.emp_salary))
+    return totals, aggs, changes
+
+
+def rebuild_partition(host, port, topic, partition, start, end, batch_size=10000, dedup=False, rollups=(),
+                      sketches=False):
+    # Worker process: read offsets [start, end) of one partition with an assigned consumer
+    consumer = SalaryConsumer(host, port, group_id='employee_salary_rebuild', auto_commit=False)
+    totals, aggs, changes, records = Counter(), {}, {}, 0
+    replay = EmployeeReplay(dedup, rollups, sketches) if dedup or rollups or sketches else None
+    try:
+        tp = TopicPartition(topic, partition, start)
+        consumer.assign([tp])
+        position = start
+        while position < end:
+            msgs = Consumer.consume(consumer, num_messages=batch_size, timeout=1.0)
+            # Anything produced after the end snapshot belongs to the streaming consumer
+            batch = [msg for msg in msgs if consumer.is_record(msg) and msg.offset() < end]
+            # The fetch position also moves past offsets that are not records (e.g. transaction markers)
+            position = max(position, consumer.position([tp])[0].offset)
+            if not batch:
+                continue
+            batch_totals, batch_aggs, batch_changes = sum_batch(batch, replay)
+            totals.update(batch_totals)
+            for key, value in batch_aggs.items():
+                aggs.setdefault(key, value)
+            changes.update(batch_changes)  # later offsets win
+            records += len(batch)
+    finally:
+        consumer.close()
+    return partition, totals, aggs, changes, records, replay
+
+
+def write_rebuild(cur, topic, totals, aggs, contributions, end_offsets, group_id, replay=None):
+    # One transaction replaces the totals, the applied combiner batches, the change-event index,
+    # the dedup seen-set, the rollups, the sketches and the group's stored offsets, so the
+    # streaming consumer never sees a half-rebuilt state
+    cur.execute("DELETE FROM department_salary_slot")
+    cur.execute("DELETE FROM department_employee_salary")
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO department_employee_salary (department, total_salary) VALUES %s
+    """, sorted(totals.items()))
+    cur.execute("DELETE FROM department_salary_batch")
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO department_salary_batch (batch_id, department, total_salary, emp_count) VALUES %s
+    """, [(batch_id, dept, total, count) for (batch_id, dept), (total, count) in sorted(aggs.items())])
+    cur.execute("DELETE FROM salary_pcn_contribution")
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO salary_pcn_contribution (pcn, department, salary) VALUES %s
+    """, [(pcn, dept, salary) for pcn, (dept, salary) in sorted(contributions.items())])
+    if replay is not None:
+        if replay.seen is not None:
+            SeenEmployees().replace(cur, replay.seen)
+        for rollup in replay.rollups:
+            cur.execute(rollup.ddl())
+            cur.execute(f"DELETE FROM {rollup.table}")
+            rollup.flush(cur)
+        if replay.sketches is not None:
+            # Every instance's rows go: the stopped consumers restart with empty sketches
+            replay.sketches.setup(cur)
+            cur.execute("DELETE FROM salary_sketches")
+            replay.sketches.persist(cur)
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO salary_consumer_offsets (group_id, topic, kafka_partition, next_offset)
+        VALUES %s
+        ON CONFLICT (group_id, topic, kafka_partition)
+        DO UPDATE SET next_offset = EXCLUDED.next_offset
+    """, [(group_id, topic, partition, offset) for partition, offset in sorted(end_offsets.items())])
+
+
+def rebuild(host, port, group_id, topic=employee_topic_name, workers=0, batch_size=10000, db=None, dedup=False,
+            rollups=(), sketches=False):
+    start_time = time.perf_counter()
+    db = db or SalaryDatabase()
+    if not dedup and db.run(SeenEmployees().in_use):
+        # The consumers skipped duplicate employees; counting every copy would disagree with them
+        raise ValueError("salary_seen_employee is in use (consumer.py --dedup): rebuild with --dedup")
+    # Snapshot every partition's watermarks up front: the rebuild covers exactly [low, high)
+    probe = SalaryConsumer(host, port, group_id=group_id, auto_commit=False)
+    partitions = sorted(probe.list_topics(topic, timeout=10).topics[topic].partitions)
+    ranges = {p: probe.get_watermark_offsets(TopicPartition(topic, p), timeout=10) for p in partitions}
+    for p, (low, high) in ranges.items():
+        if low > 0:
+            print(f"Warning: partition {p} starts at offset {low}, older records were deleted by retention")
+
+    # spawn, not fork: librdkafka threads do not survive a fork
+    with ProcessPoolExecutor(max_workers=workers or len(partitions),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(rebuild_partition, host, port, topic, p, low, high, batch_size, dedup, rollups,
+                               sketches)
+                   for p, (low, high) in ranges.items() if high > low]
+        results = [future.result() for future in futures]
+
+    totals, aggs, changes, records = Counter(), {}, {}, 0
+    replay = EmployeeReplay(dedup, rollups, sketches) if dedup or rollups or sketches else None
+    for _, part_totals, part_aggs, part_changes, part_records, part_replay in results:
+        totals.update(part_totals)
+        if replay is not None:
+            replay.merge(part_replay)
+        for key, value in part_aggs.items():
+            aggs.setdefault(key, value)
+        changes.update(part_changes)
+        records += part_records
+    for (_, dept), (total, _) in aggs.items():
+        totals[dept] += total
+    # Change events count with the last value per key; retracted keys count for nothing
+    contributions = {pcn: value for pcn, value in changes.items() if value is not None}
+    for dept, salary in contributions.values():
+        totals[dept] += salary
+
+    end_offsets = {p: high for p, (_, high) in ranges.items()}
+    db.run(lambda cur: write_rebuild(cur, topic, totals, aggs, contributions, end_offsets, group_id, replay))
+    # Hand-off for consumers not in exactly-once mode: the group's Kafka offsets start where the rebuild stopped
+    try:
+        probe.commit(offsets=[TopicPartition(topic, p, offset) for p, offset in end_offsets.items()],
+                     asynchronous=False)
+    except KafkaException as err:
+        # The database side is already committed; --exactly-once consumers resume from it regardless
+        print(f"Could not commit the end offsets to Kafka for group '{group_id}' ({err}). Consumers in "
+              f"--exactly-once mode resume correctly; reset the group's offsets before starting any others.")
+    finally:
+        probe.close()
+    elapsed = time.perf_counter() - start_time
+    print(f"Rebuilt {len(totals)} department totals from {records} records "
+          f"({len(aggs)} combiner batches) in {elapsed:.2f}s")
+    print(f"Group '{group_id}' continues from {end_offsets}")
+    return totals, end_offsets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild department_employee_salary from the topic and hand the '
+                                                 'end offsets to the streaming consumer group')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='29092')
+    parser.add_argument('--group', default='employee_consumer_salary', help="the streaming consumer's group id")
+    parser.add_argument('--workers', type=int, default=0, help='reader processes (0 = one per partition)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='messages decoded and summed per batch')
+    parser.add_argument('--dedup', action='store_true',
+                        help='the consumers run with --dedup: count the first copy of each employee key and '
+                             'rebuild salary_seen_employee')
+    parser.add_argument('--rollup', action='append', metavar='DIM,DIM',
+                        help="rebuild this rollup table too (the consumers' --rollup specs), can be repeated")
+    parser.add_argument('--sketches', action='store_true',
+                        help='rebuild salary_sketches too; the consumers start new sketches after the rebuild')
+    args = parser.parse_args()
+    try:
+        rollups = [parse_rollup(spec) for spec in args.rollup or []]
+        totals, _ = rebuild(args.host, args.port, args.group, workers=args.workers, batch_size=args.batch_size,
+                            dedup=args.dedup, rollups=rollups, sketches=args.sketches)
+    except ValueError as err:
+        parser.error(str(err))
+    for dept, total in sorted(totals.items()):
+        print(f"  {dept}: {total}")
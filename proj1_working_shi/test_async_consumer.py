@@ -0,0 +1,157 @@
+# Tests for async_consumer.py (run from this folder: python -m pytest -q)
+
+import asyncio
+
+import asyncpg
+import pytest
+from confluent_kafka import TopicPartition
+
+import async_consumer
+from async_consumer import AsyncSalaryConsumer
+from employee import Employee
+
+
+class FakeMessage:
+    def __init__(self, value, partition=0, offset=0):
+        self._value = value.encode('utf-8')
+        self._partition = partition
+        self._offset = offset
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return None
+
+    def topic(self):
+        return 't'
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def execute(self, sql, *args):
+        self.pool.attempts += 1
+        if self.pool.failures:
+            self.pool.failures -= 1
+            raise asyncpg.ConnectionDoesNotExistError('connection was closed in the middle of operation')
+        self.pool.executed.append(args)
+
+
+class FakePool:
+    # Stands in for an asyncpg pool whose first `failures` statements hit a dropped connection
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = 0
+        self.executed = []
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return FakeConnection(pool)
+
+            async def __aexit__(self, *exc):
+                return False
+        return Acquire()
+
+
+def write(pool, retries=1):
+    consumer = AsyncSalaryConsumer(None, pool)
+    msgs = [FakeMessage(Employee('CIT', 100).to_json()), FakeMessage(Employee('ECC', 50).to_json())]
+    asyncio.run(consumer.write_batch(msgs, retries))
+
+
+def test_write_batch_retries_after_connection_error():
+    pool = FakePool(failures=1)
+    write(pool)
+    assert pool.attempts == 2
+    assert pool.executed == [(['CIT', 'ECC'], [100, 50])]
+
+
+def test_write_batch_raises_connection_error_once_retries_are_used():
+    pool = FakePool(failures=2)
+    with pytest.raises(asyncpg.ConnectionDoesNotExistError):
+        write(pool)
+    assert pool.attempts == 2
+    assert pool.executed == []
+
+
+class FakeKafka:
+    # SalaryConsumer stand-in: hands out the given polls, then stops; close() revokes every
+    # partition seen, as librdkafka does for a subscribed consumer
+    def __init__(self, polls):
+        self.polls = list(polls)
+        self.partitions = sorted({msg.partition() for poll in polls for msg in poll})
+        self.keep_runnning = True
+        self.commits = []
+        self.on_revoke = None
+
+    def subscribe(self, topics, on_revoke):
+        self.on_revoke = on_revoke
+
+    def consume(self, num_messages, timeout):
+        if not self.polls:
+            self.keep_runnning = False
+            return []
+        return self.polls.pop(0)
+
+    def is_record(self, msg):
+        return True
+
+    def commit(self, offsets, asynchronous):
+        if not asynchronous:
+            self.commits.append(sorted((tp.partition, tp.offset) for tp in offsets))
+
+    def close(self):
+        self.on_revoke(self, [TopicPartition('t', p) for p in self.partitions])
+
+
+def messages(partition, offsets):
+    return [FakeMessage(Employee('CIT', 100).to_json(), partition, offset) for offset in offsets]
+
+
+def test_revoked_partitions_are_committed_and_forgotten():
+    async def scenario():
+        kafka = FakeKafka([])
+        consumer = AsyncSalaryConsumer(kafka, FakePool(failures=0))
+        consumer.loop = asyncio.get_running_loop()
+        await consumer.queue_for(('t', 0)).put(messages(0, [0, 1]))
+        await consumer.queue_for(('t', 1)).put(messages(1, [0]))
+        await consumer.loop.run_in_executor(None, consumer.on_revoke, kafka, [TopicPartition('t', 0)])
+        assert kafka.commits == [[(0, 2)]]
+        assert list(consumer.queues) == list(consumer.writers) == list(consumer.done_offsets) == [('t', 1)]
+        consumer.commit_done([('t', 0), ('t', 1)])
+        assert kafka.commits[-1] == [(1, 1)]
+    asyncio.run(scenario())
+
+
+def test_shutdown_after_a_failed_write_does_not_hang(monkeypatch):
+    # The first write fails for good; closing revokes both partitions while batches are still queued
+    polls = [messages(0, [0]), messages(0, [1]) + messages(1, [0]), messages(0, [2])]
+    kafka = FakeKafka(polls)
+    monkeypatch.setattr(async_consumer, 'Consumer', FakeKafka)
+    consumer = AsyncSalaryConsumer(kafka, FakePool(failures=10))
+    with pytest.raises(asyncpg.ConnectionDoesNotExistError):
+        asyncio.run(asyncio.wait_for(consumer.run(['t']), 5))
+    assert not consumer.queues and not consumer.writers
+    assert kafka.commits == []
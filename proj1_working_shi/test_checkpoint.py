@@ -0,0 +1,46 @@
+# Tests for checkpoint.py and the block reader it resumes (run from this folder: python -m pytest -q)
+
+from checkpoint import IngestCheckpoint
+from producer import DataHandler
+
+header = 'Department,Initial Hire Date,Salary\n'
+lines = [f"CIT,01-Jan-2015,{1000 + i}\n" for i in range(40)]
+
+
+def test_stream_blocks_end_offsets_fall_on_line_ends(tmp_path):
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_bytes((header + ''.join(lines)).encode('utf-8'))
+    data = csv_path.read_bytes()
+    blocks = list(DataHandler().stream_blocks(str(csv_path), block_bytes=50))
+    ends = [end for _, _, end in blocks]
+    assert ends == sorted(ends) and ends[-1] == len(data)
+    assert all(data[end - 1:end] == b'\n' for end in ends)
+    assert [s for _, salaries, _ in blocks for s in salaries] == [1000 + i for i in range(40)]
+    # Resuming at a block's end reads exactly the rows after it
+    rest = DataHandler().stream_blocks(str(csv_path), start=ends[2], block_bytes=50)
+    assert [s for _, salaries, _ in rest for s in salaries] == [s for _, salaries, _ in blocks[3:] for s in salaries]
+
+
+def test_resume_offset_after_append_and_after_rewrite(tmp_path):
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text(header + ''.join(lines[:20]))
+    offset = csv_path.stat().st_size
+    IngestCheckpoint(str(tmp_path / 'checkpoint.json')).save(str(csv_path), offset, 20)
+
+    # Appended rows: resume where the last run stopped
+    with open(csv_path, 'a') as f:
+        f.write(''.join(lines[20:]))
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.json'))
+    assert checkpoint.resume_offset(str(csv_path)) == offset
+    assert checkpoint.state['rows'] == 20
+
+    # Rewritten before the offset (same size): start over
+    csv_path.write_text(header + lines[1] + lines[0] + ''.join(lines[2:]))
+    assert csv_path.stat().st_size > offset
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.json'))
+    assert checkpoint.resume_offset(str(csv_path)) == 0
+    assert checkpoint.state == {}
+
+    # Truncated below the offset: start over
+    csv_path.write_text(header + lines[0])
+    assert IngestCheckpoint(str(tmp_path / 'checkpoint.json')).resume_offset(str(csv_path)) == 0
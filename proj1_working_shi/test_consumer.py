@@ -0,0 +1,115 @@
+# Tests for consumer.py's batch writes against a fake cursor (run from this folder: python -m pytest -q)
+
+import psycopg2
+
+from consumer import ConsumingMethods
+from employee import Employee, SalaryChange
+from sketches import DepartmentSketches
+
+
+class FakeMessage:
+    def __init__(self, value, partition=0, offset=0):
+        self._value = value.encode('utf-8')
+        self._partition = partition
+        self._offset = offset
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return None
+
+    def topic(self):
+        return 't'
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+
+class FakeCursor:
+    # Records statements and the rows execute_values sends; fetchall() returns the given rows
+    class connection:
+        encoding = 'UTF8'
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+        self.values = []
+
+    def mogrify(self, template, args):
+        self.values.append(tuple(args))
+        return repr(tuple(args)).encode('utf-8')
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDatabase:
+    # SalaryDatabase stand-in: runs work on a fresh FakeCursor; the work in failing raises instead
+    def __init__(self):
+        self.cursors = []
+        self.failing = None
+
+    def run(self, work):
+        if work == self.failing:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.cursors.append(FakeCursor())
+        return work(self.cursors[-1])
+
+
+def test_failed_sketch_persist_keeps_the_batch_and_the_dirty_sketches():
+    db = FakeDatabase()
+    sketches = DepartmentSketches('test', persist_interval=0)
+    methods = ConsumingMethods(db, sketches=sketches)
+    msgs = [FakeMessage(Employee('CIT', 100).to_json(), offset=0), FakeMessage(Employee('ECC', 50).to_json(), offset=1)]
+    db.failing = sketches.persist
+    methods.add_salary_batch(msgs)
+    assert len(db.cursors) == 1 and db.cursors[0].values == [('CIT', 100), ('ECC', 50)]
+    assert sketches.dirty == {'CIT', 'ECC'}
+
+    # Once the database is back the next batch writes both departments
+    db.failing = None
+    methods.add_salary_batch([FakeMessage(Employee('CIT', 200).to_json(), offset=2)])
+    assert {row[1] for row in db.cursors[-1].values} == {'CIT', 'ECC'}
+    assert sketches.dirty == set()
+
+
+def test_apply_changes_turns_events_into_deltas_against_the_stored_contributions():
+    methods = ConsumingMethods(FakeDatabase())
+    # Stored before this batch: P.1#a counts 100 in CIT, P.4#d counts 30 in EMS
+    cur = FakeCursor(rows=[('P.1#a', 'CIT', 100), ('P.4#d', 'EMS', 30)])
+    changes = [SalaryChange('upsert', 'P.1#a', 'CIT', 150), SalaryChange('upsert', 'P.2#b', 'ECC', 50),
+               SalaryChange('upsert', 'P.2#b', 'ECC', 70), SalaryChange('retract', 'P.3#c'),
+               SalaryChange('retract', 'P.4#d')]
+    assert methods.apply_changes(cur, changes) == "adjusted {'CIT': 50, 'ECC': 70, 'EMS': -30}"
+    select, upsert, delete, totals = cur.statements
+    assert select[1] == (['P.1#a', 'P.2#b', 'P.3#c', 'P.4#d'],)
+    assert delete[1] == (['P.3#c', 'P.4#d'],)
+    # execute_values rows: the new contributions, then the department deltas
+    assert cur.values == [('P.1#a', 'CIT', 150), ('P.2#b', 'ECC', 70), ('CIT', 50), ('ECC', 70), ('EMS', -30)]
+
+    # Replaying the same batch against the state it produced changes nothing
+    replay = FakeCursor(rows=[('P.1#a', 'CIT', 150), ('P.2#b', 'ECC', 70)])
+    assert methods.apply_changes(replay, changes) == "adjusted {}"
+
+
+def test_skip_applied_drops_messages_below_the_stored_offsets():
+    methods = ConsumingMethods(FakeDatabase(), offsets_group='g')
+    decoded = [(FakeMessage(Employee('CIT', 100).to_json(), partition, offset), None)
+               for partition, offsets in ((0, range(3, 7)), (1, range(2))) for offset in offsets]
+    # Partition 0 was applied up to offset 5 by an earlier owner; partition 1 has no stored offset
+    cur = FakeCursor(rows=[('t', 0, 5)])
+    kept = methods.skip_applied(cur, decoded)
+    assert [(msg.partition(), msg.offset()) for msg, _ in kept] == [(0, 5), (0, 6), (1, 0), (1, 1)]
+    assert cur.statements[0][1] == ('g', (('t', 0), ('t', 1)))
+    assert methods.skip_applied(FakeCursor(), []) == []
+
+    # The offsets stored with the batch are the next ones to read per partition
+    methods.store_offsets(cur, [msg for msg, _ in decoded])
+    assert cur.values == [('g', 't', 0, 7), ('g', 't', 1, 2)]
@@ -0,0 +1,111 @@
+# Tests for dedup.py and the employee keys it works on (run from this folder: python -m pytest -q)
+
+import os
+from collections import Counter
+
+from dedup import DedupFilter
+from producer import DataHandler, csv_file, snapshot_delivered
+
+header = 'Department,Department-Division,PCN,Position Title,FLSA Status,Initial Hire Date,Date in Title,Salary\n'
+rows = ['CIT,CIT 01,P.1,Analyst,Exempt,01-Jan-2015,,50000\n',
+        'CIT,CIT 01,P.1,Analyst,Exempt,01-Jan-2015,,50000\n',  # identical row: a second employee
+        'CIT,CIT 01,P.1,Analyst,Exempt,01-Mar-2016,,52000\n',  # another holder of the same PCN
+        'ECC,ECC 02,P.2,Dispatcher,Non Exempt,01-Jan-2012,,40000\n']
+
+
+def keys(tmp_path, lines):
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text(header + ''.join(lines))
+    reader = DataHandler()
+    return reader.transform_dimensions(reader.read_csv(str(csv_path)))['Key'].tolist()
+
+
+def test_employee_keys_depend_on_row_content_only(tmp_path):
+    first = keys(tmp_path, rows)
+    assert first[1] == first[0] + '-1'
+    assert len(set(first)) == 4
+    assert all(key.startswith(pcn + '#') for key, pcn in zip(first, ['P.1', 'P.1', 'P.1', 'P.2']))
+    # An overlapping extract in another order, with a row removed, keeps every employee's key
+    assert keys(tmp_path, [rows[3], rows[2], rows[0]]) == [first[3], first[2], first[0]]
+
+
+def test_change_keys_survive_salary_corrections_only(tmp_path):
+    # --changes re-sends a corrected extract under the same keys; a corrected department
+    # (or title, or hire date) is a new key and the old one has to be retracted
+    first = keys(tmp_path, rows)
+    assert keys(tmp_path, [row.replace('50000', '51000') for row in rows]) == first
+    moved = keys(tmp_path, rows[:3] + [rows[3].replace('ECC,ECC 02', 'EMS,EMS 02')])
+    assert moved[:3] == first[:3] and moved[3] != first[3] and moved[3].startswith('P.2#')
+
+
+def test_dedup_keeps_every_employee_of_one_extract(tmp_path):
+    # Department totals with --dedup match a plain run; a second run of the same extract adds nothing
+    depts, salaries = DataHandler().transform_file(csv_file)
+    plain = Counter()
+    for dept, salary in zip(depts, salaries.tolist()):
+        plain[dept] += salary
+    dedup = DedupFilter(str(tmp_path / 'seen.bloom'))
+    reader = DataHandler(dedup=dedup)
+    deduped = Counter()
+    for frame in reader.stream_dimensions(csv_file, chunksize=500):
+        for dept, salary in zip(frame['Department'], frame['Salary'].tolist()):
+            deduped[dept] += salary
+    assert deduped == plain and reader.duplicates == 0
+    assert sum(len(frame) for frame in reader.stream_dimensions(csv_file)) == 0
+    assert reader.duplicates == len(depts)
+    dedup.close()
+
+
+def test_dedup_filter_rebuilds_a_stale_bloom_snapshot(tmp_path):
+    path = str(tmp_path / 'seen.bloom')
+    dedup = DedupFilter(path, initial_capacity=100)
+    dedup.add(['a', 'b'])
+    dedup.snapshot()
+    # Keys committed to SQLite after the last filter snapshot, as if the process died before it
+    dedup.add(['c'])
+    dedup.exact.commit()
+    dedup.close()
+
+    dedup = DedupFilter(path, initial_capacity=100)
+    assert dedup.new_mask(['a', 'b', 'c', 'd']).tolist() == [False, False, False, True]
+    assert dedup.false_positives == 0
+    dedup.close()
+
+    os.remove(path)
+    dedup = DedupFilter(path, initial_capacity=100)
+    assert dedup.new_mask(['a', 'c', 'd']).tolist() == [False, False, True]
+    dedup.close()
+
+
+class FakeSender:
+    # PipelinedSender stand-in: counts flushes, and deliveries fail once failing is set
+    def __init__(self):
+        self.failed = Counter()
+        self.flushes = 0
+        self.failing = False
+
+    def flush(self, timeout=-1):
+        self.flushes += 1
+        if self.failing:
+            self.failed[0] += 1
+        return 0
+
+
+def test_delivered_keys_are_snapshotted_between_frames(tmp_path):
+    path = str(tmp_path / 'seen.bloom')
+    dedup = DedupFilter(path, initial_capacity=100, snapshot_interval=0)
+    reader = DataHandler(dedup=dedup)
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text(header + ''.join(rows))
+    sender = FakeSender()
+    committed = []
+    for i, frame in enumerate(snapshot_delivered(reader.stream_dimensions(str(csv_path), chunksize=1), sender, dedup)):
+        # Keys of the frames before this one were delivered and snapshotted; this frame's are not yet
+        reopened = DedupFilter(path, initial_capacity=100)
+        committed.append(reopened.key_count())
+        reopened.close()
+        sender.failing = i == 1
+    # The second frame's delivery failed: neither it nor anything after it is snapshotted
+    assert committed == [0, 1, 1, 1]
+    assert sender.flushes == 2
+    dedup.close()
@@ -0,0 +1,25 @@
+# Tests for parse_cache.py (run from this folder: python -m pytest -q)
+
+import numpy as np
+
+from parse_cache import ParseCache
+from producer import DataHandler
+
+
+def test_cache_hit_matches_uncached_transform(tmp_path):
+    csv_path = tmp_path / 'salaries.csv'
+    # Salaries just below a whole number, where float32 rounding would change the truncated value
+    csv_path.write_text('Department,Initial Hire Date,Salary\n'
+                        'CIT,01-Jan-2015,99999.999\n'
+                        'ECC,01-Jan-2016,262144.99\n'
+                        'EMS,01-Jan-2017,16777215.99\n'
+                        'CIT,01-Jan-2018,\n'
+                        'ECC,01-Jan-2009,50000.50\n')
+    expected_depts, expected_salaries = DataHandler().transform_file(str(csv_path))
+    assert expected_salaries.tolist() == [99999, 262144, 16777215]
+
+    reader = DataHandler(ParseCache(str(tmp_path / 'cache')))
+    for _ in range(2):  # miss (store, then load), then hit
+        depts, salaries = reader.transform_file(str(csv_path))
+        assert list(depts) == list(expected_depts)
+        assert np.array_equal(salaries, expected_salaries)
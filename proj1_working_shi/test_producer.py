@@ -0,0 +1,77 @@
+# Tests for producer.py (run from this folder: python -m pytest -q)
+
+import json
+from collections import Counter
+
+import numpy as np
+import pytest
+from confluent_kafka.serialization import StringSerializer
+
+from checkpoint import IngestCheckpoint
+from producer import LatencyHistogram, SalaryCombiner, produce_incremental
+
+
+def combine(depts, salaries, chunksize, flush_every):
+    # Aggregates of one run, flushing after every flush_every chunks like a time window would
+    combiner = SalaryCombiner('src', batch_rows=1000)
+    aggs = []
+    for i, start in enumerate(range(0, len(depts), chunksize)):
+        combiner.add(depts[start:start + chunksize], salaries[start:start + chunksize])
+        if i % flush_every == 0:
+            aggs += combiner.flush()
+    aggs += combiner.flush(final=True)
+    return sorted((a.batch_id, a.emp_dept, int(a.total_salary), int(a.emp_count)) for a in aggs)
+
+
+def test_combiner_batches_do_not_depend_on_chunksize_or_window():
+    rng = np.random.default_rng(0)
+    depts = rng.choice(np.array(['CIT', 'ECC', 'EMS'], dtype=object), 2500)
+    salaries = rng.integers(1000, 9000, 2500)
+    expected = combine(depts, salaries, 2500, 1)
+    assert {batch_id for batch_id, *_ in expected} == {'src-r0-1000', 'src-r1000-2000', 'src-r2000-2500'}
+    assert sum(total for _, _, total, _ in expected) == salaries.sum()
+    for chunksize in (1, 7, 300, 1000, 1333):
+        for flush_every in (1, 3):
+            assert combine(depts, salaries, chunksize, flush_every) == expected
+
+
+class FakeSender:
+    # PipelinedSender stand-in: every message is delivered at once
+    def __init__(self):
+        self.failed = Counter()
+        self.values = []
+
+    def send(self, topic, key, value, headers=None):
+        self.values.append(json.loads(value))
+
+    def flush(self, timeout=-1):
+        return 0
+
+
+def test_checkpointed_combiner_rejects_a_different_block_size(tmp_path):
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text('Department,Initial Hire Date,Salary\n'
+                        + 'CIT,01-Jan-2015,100\nECC,01-Jan-2016,200\n' * 50)
+    checkpoint = IngestCheckpoint(str(tmp_path / 'checkpoint.json'))
+    sender = FakeSender()
+    produce_incremental(sender, StringSerializer('utf-8'), str(csv_path), checkpoint, 512, combine=True)
+    assert sum(agg['total_salary'] for agg in sender.values) == 15000
+    # Reloaded from disk, as a rerun would
+    with pytest.raises(ValueError):
+        produce_incremental(FakeSender(), StringSerializer('utf-8'), str(csv_path),
+                            IngestCheckpoint(str(tmp_path / 'checkpoint.json')), 1024, combine=True)
+
+
+def test_latency_histogram_percentiles_stay_within_a_bucket():
+    rng = np.random.default_rng(1)
+    samples = rng.lognormal(np.log(0.005), 1.0, 20000)
+    halves = LatencyHistogram(), LatencyHistogram()
+    for i, seconds in enumerate(samples):
+        halves[i % 2].observe(seconds)
+    histogram = LatencyHistogram()
+    for half in halves:
+        histogram.merge(half)
+    assert len(histogram) == len(samples)
+    for got, want in zip(histogram.percentiles([50, 99, 99.9]), np.percentile(samples, [50, 99, 99.9])):
+        assert abs(got / want - 1) < 0.02
+    assert np.isnan(LatencyHistogram().percentiles([50])[0])
@@ -0,0 +1,28 @@
+# Tests for quality.py (run from this folder: python -m pytest -q)
+
+from producer import DataHandler
+from quality import DataQuality
+
+
+def test_rules_reject_bad_rows_with_reason_codes(tmp_path):
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text('Department,Initial Hire Date,Salary\n'
+                        'CIT,01-Jan-2015,50000\n'
+                        'XYZ,01-Jan-2015,50000\n'  # well-formed but unknown department code
+                        'cit,01-Jan-2015,50000\n'
+                        ',01-Jan-2015,50000\n'
+                        'ECC,01-Jan-2015,\n'
+                        'ECC,01-Jan-2015,12x\n'
+                        'EMS,,50000\n'
+                        'EMS,2015/01/01,50000\n')
+    reject_path = tmp_path / 'rejects.csv'
+    quality = DataQuality(str(reject_path))
+    depts, salaries = DataHandler(quality=quality).transform_file(str(csv_path))
+
+    assert list(depts) == ['CIT'] and salaries.tolist() == [50000]
+    assert quality.rows == 8
+    assert dict(quality.counts) == {'unknown_department': 2, 'missing_department': 1, 'missing_salary': 1,
+                                    'bad_salary': 1, 'missing_hire_date': 1, 'bad_hire_date': 1}
+    lines = reject_path.read_text().splitlines()
+    assert lines[0].endswith(',reason') and lines[1] == 'XYZ,01-Jan-2015,50000,unknown_department'
+    assert len(lines) == 8